@@ -0,0 +1,170 @@
+import collections
+import operator
+import numpy as np
+import db, funcs
+
+# A user's workouts as parallel NumPy columns, sorted by day:
+#   days       int32 day numbers (days since 01-01-1970, see funcs.date_to_day)
+#   durations  int32 minutes
+#   calories   int32 calories burned
+#   codes      int32 index of each workout's exercise in 'exercises'
+#   exercises  array of the distinct exercise names, sorted
+Workouts = collections.namedtuple("Workouts", "days durations calories codes exercises")
+
+# Columns that can be totalled by the functions below
+FIELDS = ("calories", "durations")
+
+
+# Function to build a Workouts table from (exercise, day, duration, calories) rows
+def from_rows(rows):
+    # Skip rows from very old databases whose date couldn't be converted or whose numbers are missing
+    rows = [row for row in rows if isinstance(row[1], int) and row[2] is not None and row[3] is not None]
+    count = len(rows)
+    columns = [np.fromiter(map(operator.itemgetter(i), rows), dtype=np.int32, count=count) for i in (1, 2, 3)]
+    return from_columns(map(operator.itemgetter(0), rows), *columns)
+
+
+# Function to build a Workouts table from separate columns (exercise names and three integer arrays)
+def from_columns(names, days, durations, calories):
+    # Dictionary-encode the exercise names: a dict lookup per row is much cheaper than sorting strings
+    index = {}
+    codes = np.fromiter((index.setdefault(name, len(index)) for name in names), dtype=np.int32, count=len(days))
+    return _encoded(days, durations, calories, codes, list(index))
+
+
+# Function to finish a Workouts table from columns whose exercises are codes into the list 'names'
+def _encoded(days, durations, calories, codes, names):
+    exercises = np.array(names, dtype=object)
+    order = np.argsort(exercises)
+    if np.any(order != np.arange(len(order))):
+        remap = np.empty(len(order), dtype=np.int32)
+        remap[order] = np.arange(len(order), dtype=np.int32)  # Renumber codes to follow the sorted names
+        codes = remap[codes]
+    if len(days) > 1 and np.any(days[1:] < days[:-1]):
+        by_day = np.argsort(days, kind="stable")  # db returns rows in date order, so this is rarely needed
+        days, durations, calories, codes = days[by_day], durations[by_day], calories[by_day], codes[by_day]
+    return Workouts(days, durations, calories, codes, exercises[order])
+
+
+# Function to load one user's workouts (optionally only those between 'start' and 'end', or of one exercise)
+# Archived workouts are used straight from the memory-mapped archive file; the rest are streamed from the
+# database in array-backed chunks, so no per-row Python objects are kept
+def load_workouts(user_id, start=None, end=None, exercise=None, chunk_size=50000):
+    index = {}  # exercise name -> code, shared by all chunks
+    parts = []
+    archived = db.get_archive(user_id)
+    if archived is not None and len(archived):
+        parts.append(_archived_columns(archived, start, end, exercise, index))
+    for batch in db.iter_workouts(user_id, start, end, exercise, chunk_size=chunk_size, arrays=True, archived=False):
+        # Translate the chunk's own exercise codes into the shared ones
+        remap = np.array([index.setdefault(name, len(index)) for name in batch.exercises], dtype=np.int32)
+        parts.append((np.frombuffer(batch.days, dtype=np.intc), np.frombuffer(batch.durations, dtype=np.intc),
+                      np.frombuffer(batch.calories, dtype=np.intc), remap[np.frombuffer(batch.codes, dtype=np.intc)]))
+    if not parts:
+        return from_rows([])
+    if len(parts) == 1:
+        days, durations, calories, codes = parts[0]  # Nothing to join, so views of an archive stay views
+    else:
+        days, durations, calories, codes = (np.concatenate(column).astype(np.int32, copy=False) for column in zip(*parts))
+    return _encoded(days, durations, calories, codes, list(index))
+
+
+# Function to get the (days, durations, calories, codes) columns of an archive as read-only views of the file,
+# limited to the dates 'start' to 'end' and one exercise if given; codes are added to 'index' like a chunk's
+def _archived_columns(archived, start, end, exercise, index):
+    low, high = archived.span(funcs.date_to_day(start) if start is not None else None,
+                              funcs.date_to_day(end) if end is not None else None)
+    days, durations, calories, codes = (np.frombuffer(column, dtype=np.intc)[low:high] for column in
+                                        (archived.days, archived.durations, archived.calories, archived.codes))
+    names = archived.exercises
+    if exercise is not None:
+        keep = codes == (names.index(exercise) if exercise in names else -1)
+        days, durations, calories, codes = days[keep], durations[keep], calories[keep], codes[keep]
+    # Only exercises with workouts in the selection get a code, as they would from database chunks
+    if exercise is None and (low, high) == (0, len(archived)):
+        used = range(len(names))
+    else:
+        used = np.flatnonzero(np.bincount(codes, minlength=len(names))).tolist()
+    remap = np.zeros(len(names), dtype=np.int32)
+    for code in used:
+        remap[code] = index.setdefault(names[code], len(index))
+    if not np.array_equal(remap, np.arange(len(remap))):
+        codes = remap[codes]
+    return days, durations, calories, codes
+
+
+# Function to add up 'values' over runs of equal, sorted 'keys'; returns (distinct keys, totals)
+def _group_sum(keys, values):
+    if len(keys) == 0:
+        return keys[:0], values[:0].astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])  # Index where each run of equal keys begins
+    return keys[starts], np.add.reduceat(values.astype(np.int64), starts)
+
+
+# Function to get the total of 'field' for each day with workouts; returns (days, totals)
+def daily_totals(workouts, field="calories"):
+    return _group_sum(workouts.days, getattr(workouts, field))
+
+
+# Function to get the total of 'field' per week (weeks start on Monday); returns (first day of each week, totals)
+def weekly_totals(workouts, field="calories"):
+    # Day 0 (01-01-1970) was a Thursday, so shifting by 3 lines weeks up with Mondays
+    weeks = (workouts.days + 3) // 7 * 7 - 3
+    return _group_sum(weeks, getattr(workouts, field))
+
+
+# Function to get the total of 'field' per calendar month; returns (first day of each month, totals)
+def monthly_totals(workouts, field="calories"):
+    months = workouts.days.astype("datetime64[D]").astype("datetime64[M]").astype("datetime64[D]")
+    return _group_sum(months.astype(np.int32), getattr(workouts, field))
+
+
+# Function to get per-exercise statistics of 'field'; returns (exercise names, workout counts, means, medians)
+def exercise_stats(workouts, field="calories"):
+    values = getattr(workouts, field)
+    groups = len(workouts.exercises)
+    counts = np.bincount(workouts.codes, minlength=groups)
+    means = np.bincount(workouts.codes, weights=values, minlength=groups) / np.maximum(counts, 1)
+
+    # Sort values within each exercise; each group's median is then found by position
+    # (packing code and value into one integer makes this a single fast sort instead of a lexsort)
+    # (offsetting by the smallest value keeps every packed value below 'span')
+    lowest = int(values.min()) if len(values) else 0
+    span = int(values.max()) - lowest + 1 if len(values) else 1
+    packed = np.sort(workouts.codes.astype(np.int64) * span + (values.astype(np.int64) - lowest))
+    ordered = (packed % span + lowest).astype(np.float64)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    lower = starts + (counts - 1) // 2
+    upper = starts + counts // 2
+    medians = (ordered[lower] + ordered[upper]) / 2 if groups else np.zeros(0)
+    return workouts.exercises, counts, means, medians
+
+
+# Function to get a rolling average of the daily totals of 'field' over the last 'window' days
+# Days without workouts count as 0; returns (every day from the first to the last workout, averages)
+def rolling_average(workouts, window=7, field="calories"):
+    days, totals = daily_totals(workouts, field)
+    if len(days) == 0:
+        return days, np.zeros(0)
+    calendar = np.zeros(days[-1] - days[0] + 1, dtype=np.int64)
+    calendar[days - days[0]] = totals
+    sums = np.cumsum(calendar)
+    sums[window:] = sums[window:] - sums[:-window]  # Sum of the 'window' days ending on each day
+    lengths = np.minimum(np.arange(1, len(calendar) + 1), window)  # Fewer days are available at the start
+    return np.arange(days[0], days[-1] + 1, dtype=np.int32), sums / lengths
+
+
+# Function to find workout streaks (runs of consecutive days with at least one workout)
+# Returns (longest streak, current streak as of 'today', or as of the last workout if 'today' is None)
+def streaks(workouts, today=None):
+    days, _ = _group_sum(workouts.days, workouts.calories)  # Distinct days (the column is sorted)
+    if len(days) == 0:
+        return 0, 0
+    breaks = np.flatnonzero(np.diff(days) != 1)  # Last index of every streak except the final one
+    ends = np.r_[breaks, len(days) - 1]
+    starts = np.r_[0, breaks + 1]
+    lengths = ends - starts + 1
+    current = int(lengths[-1])
+    if today is not None and today - days[-1] > 1:
+        current = 0  # The last streak ended before yesterday
+    return int(lengths.max()), current
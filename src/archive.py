@@ -0,0 +1,164 @@
+# Columnar archive files for old workouts (see db.archive_workouts)
+# Each user's archived workouts are stored in one file, column by column, sorted by (day, workout ID):
+#   header     magic, counts, total duration and calories
+#   columns    workout IDs (64-bit), then days, durations, calories and exercise codes (32-bit C ints)
+#   per day    day, workouts, total duration, total calories (64-bit), one entry per day with workouts
+#   per exercise  workouts, total duration, total calories (64-bit), one entry per exercise
+#   names      the exercise names as a JSON list, sorted, so codes are positions in it
+# Numbers are in the machine's byte order. Files are never changed once written: a new version of a user's
+# archive is written next to the old one under the next generation number, and the database records which
+# generation is current, so readers can map a file into memory and use its columns without copying them.
+import array
+import bisect
+import functools
+import glob
+import json
+import mmap
+import os
+import struct
+
+MAGIC = b"GFA1"
+HEADER = struct.Struct("=4sIIIIqq4x")  # magic, workouts, days, exercises, size of names, duration, calories
+
+# Archives kept mapped by load(); each costs a file handle and address space, not memory
+OPEN_ARCHIVES = 64
+
+
+# Function to return the file holding generation 'generation' of a user's archive in 'folder'
+def path(folder, user_id, generation):
+    return os.path.join(folder, f"{user_id}.{generation}.gfa")
+
+
+# A user's archived workouts, mapped read-only into memory. The columns are memoryviews into the mapping
+# (wrap them with numpy.frombuffer to get arrays without copying); 'daily' and 'exercise_totals' hold
+# the totals that stats and charts need, so those never touch the columns
+class Archive:
+    def __init__(self, file_path):
+        with open(file_path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        magic, count, days, exercises, names_size, self.total_duration, self.total_calories = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f"{file_path} is not a workout archive")
+        offset = HEADER.size
+
+        def take(code, length):
+            nonlocal offset
+            size = struct.calcsize(code) * length
+            column = view[offset:offset + size].cast(code)
+            offset += size
+            return column
+
+        self.ids = take("q", count)
+        self.days, self.durations, self.calories, self.codes = (take("i", count) for _ in range(4))
+        offset += -offset % 8  # The 64-bit sections start on an 8 byte boundary
+        self.daily = tuple(take("q", days) for _ in range(4))  # (days, workouts, duration, calories)
+        workouts, duration, calories = (take("q", exercises) for _ in range(3))
+        self.exercises = json.loads(bytes(view[offset:offset + names_size]).decode("utf-8"))
+        # (exercise, workouts, total duration, total calories) for every exercise, sorted by name
+        self.exercise_totals = list(zip(self.exercises, workouts, duration, calories))
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Function to check if any archived workout is on 'day'
+    def has_day(self, day):
+        days = self.daily[0]
+        index = bisect.bisect_left(days, day)
+        return index < len(days) and days[index] == day
+
+    # Function to return the range of positions [low, high) of the workouts between days 'start' and 'end'
+    def span(self, start=None, end=None):
+        low = bisect.bisect_left(self.days, start) if start is not None else 0
+        high = bisect.bisect_right(self.days, end) if end is not None else len(self.days)
+        return low, max(low, high)
+
+    # Function to stream archived workouts as (workout ID, exercise, day, duration, calories) tuples, ordered by
+    # (day, workout ID); takes the same filters as db.iter_workouts ('after' is a (day, workout ID) pair)
+    def rows(self, start=None, end=None, exercise=None, after=None, reverse=False):
+        low, high = self.span(start, end)
+        if after is not None:
+            # Find the first position at or after the (day, workout ID) pair
+            index = bisect.bisect_left(self.days, after[0], low, high)
+            while index < high and self.days[index] == after[0] and self.ids[index] < after[1]:
+                index += 1
+            if reverse:
+                high = index
+            else:
+                low = index + 1 if index < high and (self.days[index], self.ids[index]) == tuple(after) else index
+        step = -1 if reverse else 1
+        columns = [column[low:high][::step] for column in (self.ids, self.codes, self.days, self.durations, self.calories)]
+        names = self.exercises
+        if exercise is not None:
+            if exercise not in names:
+                return
+            code = names.index(exercise)
+            for workout_id, exercise_code, day, duration, calories in zip(*columns):
+                if exercise_code == code:
+                    yield workout_id, exercise, day, duration, calories
+            return
+        for workout_id, exercise_code, day, duration, calories in zip(*columns):
+            yield workout_id, names[exercise_code], day, duration, calories
+
+
+# Function to open an archive file; archives are immutable, so one mapping per file is shared by every caller
+@functools.lru_cache(maxsize=OPEN_ARCHIVES)
+def load(file_path):
+    return Archive(file_path)
+
+
+# Function to write an archive from (workout ID, exercise, day, duration, calories) rows sorted by (day, workout ID)
+# The file is flushed to disk before returning. Returns (workouts, total duration, total calories)
+def write(file_path, rows):
+    rows = rows if isinstance(rows, list) else list(rows)
+    names = sorted({row[1] for row in rows})
+    codes = {name: code for code, name in enumerate(names)}
+    columns = (array.array("q"),) + tuple(array.array("i") for _ in range(4))
+    ids, days, durations, calories, exercise_codes = columns
+    daily = tuple(array.array("q") for _ in range(4))
+    totals = [[0, 0, 0] for _ in names]
+    for workout_id, exercise, day, duration, cals in rows:
+        code = codes[exercise]
+        ids.append(workout_id)
+        days.append(day)
+        durations.append(duration)
+        calories.append(cals)
+        exercise_codes.append(code)
+        if not daily[0] or daily[0][-1] != day:
+            for column, value in zip(daily, (day, 0, 0, 0)):
+                column.append(value)
+        daily[1][-1] += 1
+        daily[2][-1] += duration
+        daily[3][-1] += cals
+        total = totals[code]
+        total[0] += 1
+        total[1] += duration
+        total[2] += cals
+
+    encoded_names = json.dumps(names).encode("utf-8")
+    duration_sum, calories_sum = sum(total[1] for total in totals), sum(total[2] for total in totals)
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    with open(file_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, len(rows), len(daily[0]), len(names), len(encoded_names), duration_sum, calories_sum))
+        for column in columns:
+            column.tofile(file)
+        file.write(bytes(-file.tell() % 8))
+        for column in daily:
+            column.tofile(file)
+        for field in range(3):
+            array.array("q", (total[field] for total in totals)).tofile(file)
+        file.write(encoded_names)
+        file.flush()
+        os.fsync(file.fileno())
+    return len(rows), duration_sum, calories_sum
+
+
+# Function to delete a user's archive files other than 'keep' (left behind by newer generations)
+# A file another process still has mapped can't be deleted on some systems; it is retried next time
+def remove_old(folder, user_id, keep=None):
+    for old in glob.glob(os.path.join(glob.escape(folder), f"{user_id}.*.gfa")):
+        if keep is None or os.path.abspath(old) != os.path.abspath(keep):
+            try:
+                os.remove(old)
+            except OSError:
+                pass
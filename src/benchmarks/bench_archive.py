@@ -0,0 +1,55 @@
+# Benchmark: full-history reads of one long-lived account, from the 'workouts' table vs. a columnar archive
+# Run from the 'src' directory:  python -m benchmarks.bench_archive [--rows N]
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import analytics, db
+from benchmarks import synth
+
+
+# Function to time 'func' (best of 'repeat' runs) and measure its peak Python allocations; returns (seconds, bytes)
+def measure(func, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare reading workouts from SQLite and from the archive")
+    parser.add_argument("--rows", type=int, default=500000, help="workouts of the user that is read")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.configure(os.path.join(tmp, "archive.db"))
+        db.init_db()
+        synth.populate(args.rows, users=1)
+        user_id = db.list_users()[0][0]
+        tasks = {"analytics.load_workouts": lambda: analytics.load_workouts(user_id),
+                 "db.get_workout_rows": lambda: db.get_workout_rows(user_id)}
+        results = {name: [measure(task)] for name, task in tasks.items()}
+
+        last_day = int(analytics.load_workouts(user_id).days[-1])
+        start = time.perf_counter()
+        archived = db.archive_workouts(last_day + 1)  # The whole history
+        print(f"Archived {archived} workouts in {time.perf_counter() - start:.1f}s")
+        for name, task in tasks.items():
+            results[name].append(measure(task))
+        db.close_db()
+
+    for name, ((table_time, table_peak), (archive_time, archive_peak)) in results.items():
+        print(f"{name:24s} table {table_time * 1000:9.1f} ms {table_peak / 2**20:7.1f} MiB   "
+              f"archive {archive_time * 1000:9.1f} ms {archive_peak / 2**20:7.1f} MiB   "
+              f"({table_time / archive_time:6.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# Benchmark: pooled WAL connections (db.py) vs. the old open-a-connection-per-call behaviour
+# Run from the 'src' directory:  python -m benchmarks.bench_connections [--ops N]
+import argparse
+import os
+import sqlite3 as sql
+import tempfile
+import time
+import db
+
+
+# The original data-layer behaviour: open, execute, commit, close on every call
+def legacy_log_workout(path, user_id, exercise, date, duration, calories):
+    con = sql.connect(path)
+    c = con.cursor()
+    c.execute("""INSERT INTO workouts (user_id, exercise, date, duration, calories)
+                 VALUES (?, ?, ?, ?, ?)""", (user_id, exercise, date, duration, calories))
+    con.commit()
+    con.close()
+
+
+def legacy_get_avg_stats(path, user_id):
+    con = sql.connect(path)
+    c = con.cursor()
+    c.execute("SELECT COUNT(*), AVG(duration), AVG(calories) FROM workouts WHERE user_id = ?", (user_id,))
+    stats = c.fetchone()
+    con.close()
+    return stats
+
+
+# Function to time 'ops' alternating writes and reads and return operations per second
+def run(ops, log, stats):
+    start = time.perf_counter()
+    for i in range(ops):
+        if i % 2:
+            log(1, "Running", "01-01-2024", 30, 300)
+        else:
+            stats(1)
+    return ops / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare pooled WAL connections with opening one per call")
+    parser.add_argument("--ops", type=int, default=2000, help="operations per scenario")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        # The legacy path used SQLite's defaults: rollback journal with synchronous=FULL. The schema is created
+        # through db.py, which switches the file to WAL (a setting stored in the file), so switch it back
+        path = os.path.join(tmp, "legacy.db")
+        db.configure(path)
+        db.create_tables()
+        db.close_db()
+        con = sql.connect(path)
+        mode = con.execute("PRAGMA journal_mode=DELETE").fetchone()[0]
+        con.close()
+        assert mode == "delete", f"the legacy database is in {mode} mode"
+        results["open-per-call (journal, FULL)"] = run(
+            args.ops,
+            lambda *a: legacy_log_workout(path, *a),
+            lambda u: legacy_get_avg_stats(path, u))
+
+        for sync in ("FULL", "NORMAL"):
+            path = os.path.join(tmp, f"pooled_{sync}.db")
+            db.configure(path, synchronous=sync)
+            db.create_tables()
+            results[f"pooled (WAL, {sync})"] = run(args.ops, db.log_workout, db.get_avg_stats)
+            db.close_db()
+
+    baseline = results["open-per-call (journal, FULL)"]
+    for name, rate in results.items():
+        print(f"{name:32s} {rate:10.0f} ops/s  ({rate / baseline:5.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Load test for the HTTP/JSON service: starts it on a local port against a temporary database and
+# drives it with concurrent keep-alive clients, reporting latency percentiles and requests per second
+# Run from the 'src' directory:  python -m benchmarks.bench_service [--clients N] [--requests N]
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+import db, service
+
+
+# Function to send one request on an open connection and return (status, decoded JSON body)
+async def request(reader, writer, method, path, payload=None):
+    body = json.dumps(payload).encode() if payload is not None else b""
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        key, _, value = line.decode().partition(":")
+        if key.lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+# Function for one simulated client: log in, then a mix of writes and reads; returns request latencies
+async def client(host, port, number, requests, write_ratio):
+    reader, writer = await asyncio.open_connection(host, port)
+    rng = random.Random(number)
+    _, user = await request(reader, writer, "POST", "/register", {"name": f"load-user-{number}"})
+    user_id = user["user_id"]
+    latencies = []
+    for i in range(requests):
+        start = time.perf_counter()
+        if rng.random() < write_ratio:
+            workout = {"user_id": user_id, "exercise": rng.choice(["Running", "Cycling", "Rowing"]),
+                       "date": f"{rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-2024",
+                       "duration": rng.randint(10, 90), "calories": rng.randint(50, 900)}
+            status, _ = await request(reader, writer, "POST", "/workouts", workout)
+        elif i % 10 == 0:
+            status, _ = await request(reader, writer, "GET", f"/analysis?user_id={user_id}")
+        else:
+            status, _ = await request(reader, writer, "GET", f"/stats?user_id={user_id}")
+        latencies.append(time.perf_counter() - start)
+        assert status == 200, status
+    writer.close()
+    return latencies
+
+
+async def main(args):
+    svc = service.Service(workers=args.workers)
+    host, port = await svc.start("127.0.0.1", 0)
+    start = time.perf_counter()
+    results = await asyncio.gather(*(client(host, port, n, args.requests, args.write_ratio) for n in range(args.clients)))
+    elapsed = time.perf_counter() - start
+    await svc.close()
+
+    latencies = sorted(l for result in results for l in result)
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    print(f"{len(latencies)} requests from {args.clients} clients in {elapsed:.2f} s")
+    print(f"throughput: {len(latencies) / elapsed:.0f} req/s")
+    print(f"latency: p50 {pick(0.50):.2f} ms  p99 {pick(0.99):.2f} ms  max {latencies[-1] * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the GetFit HTTP service")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent connections")
+    parser.add_argument("--requests", type=int, default=200, help="requests per client")
+    parser.add_argument("--write-ratio", type=float, default=0.2, help="fraction of requests that log a workout")
+    parser.add_argument("--workers", type=int, default=8, help="service database threads")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        db.init_db(os.path.join(tmp, "load.db"))
+        asyncio.run(main(args))
+        db.close_db()
@@ -0,0 +1,56 @@
+# Benchmark: workout logging from many threads into one database file vs. the same load spread over shards
+# Run from the 'src' directory:  python -m benchmarks.bench_shards [--threads N] [--per-thread N] [--shards 1 2 4 8]
+import argparse
+import os
+import tempfile
+import threading
+import time
+import db
+
+
+# Function to register 'threads' users and log 'per_thread' workouts for each from its own thread
+# 'mode' is None for a commit per insert, or a write-behind durability; returns inserts per second
+def run(threads, per_thread, mode):
+    user_ids = [db.user_registration(f"bench{n}") for n in range(threads)]
+    if mode is not None:
+        db.enable_write_behind(durability=mode)
+
+    def log(user_id):
+        for i in range(per_thread):
+            db.log_workout(user_id, "Running", 19000 + i % 365, 30, 300)
+
+    workers = [threading.Thread(target=log, args=(user_id,)) for user_id in user_ids]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    db.flush_writes()  # Count only workouts that are actually committed
+    return threads * per_thread / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare logging into one database file and into shards")
+    parser.add_argument("--threads", type=int, default=16, help="concurrent loggers, one user each")
+    parser.add_argument("--per-thread", type=int, default=500, help="workouts logged by each thread")
+    parser.add_argument("--shards", type=int, nargs="+", default=[2, 4, 8], help="shard counts to try")
+    parser.add_argument("--synchronous", default="FULL", help="SQLite synchronous setting (default: %(default)s)")
+    parser.add_argument("--write-behind", choices=("ack", "delay"), help="also group commits (one queue per shard)")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for shards in [0] + args.shards:
+            db.configure(os.path.join(tmp, f"shards{shards}" if shards else "single.db"),
+                         synchronous=args.synchronous, shards=shards)
+            db.init_db()
+            results[shards] = run(args.threads, args.per_thread, args.write_behind)
+            db.close_db()
+
+    for shards, rate in results.items():
+        label = f"{shards} shards" if shards else "single file"
+        print(f"{label:12s} {rate:10.0f} inserts/s  ({rate / results[0]:5.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Benchmark: how long the desktop app takes to start, measured with 'python -X importtime'
+# Run from the 'src' directory:  python -m benchmarks.bench_startup [--max-ms N]
+# Exits with status 1 if startup is slower than the threshold or pulls in a module that should load lazily
+import argparse
+import ast
+import os
+import subprocess
+import sys
+import time
+
+# Modules that must not be imported before the first window is shown
+LAZY_MODULES = ("matplotlib", "numpy")
+
+# Startup budget in milliseconds for everything main.py imports
+DEFAULT_MAX_MS = 250
+
+
+# Function to list the modules main.py imports at the top level (what every start of the app pays for)
+def startup_imports():
+    with open("main.py", encoding="utf-8") as file:
+        tree = ast.parse(file.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            modules.append(node.module)
+    return modules
+
+
+# Function to run 'code' in a fresh interpreter with -X importtime and return {module: cumulative microseconds}
+def import_times(code):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure GetFit startup time")
+    parser.add_argument("--max-ms", type=float, default=DEFAULT_MAX_MS, help="fail above this many milliseconds")
+    parser.add_argument("--runs", type=int, default=5, help="take the best of this many runs")
+    args = parser.parse_args()
+
+    # With a display, time the real thing: import main.py and draw the login window.
+    # Without one (CI, servers) Tk can't open a window, so time main.py's imports instead
+    if os.environ.get("DISPLAY") or sys.platform in ("win32", "darwin"):
+        code = "import main; main.window.update()"
+    else:
+        code = "import " + ", ".join(startup_imports())
+
+    best, times = None, {}
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        run_times = import_times(code)
+        elapsed = (time.perf_counter() - start) * 1000
+        if best is None or elapsed < best:
+            best, times = elapsed, run_times
+
+    print(f"Time to first window: {best:.1f} ms (best of {args.runs}, including interpreter start)")
+    print("Slowest top-level imports:")
+    top = [name for name in times if "." not in name.strip()]
+    for name in sorted(top, key=times.get, reverse=True)[:8]:
+        print(f"  {name:24s} {times[name] / 1000:8.1f} ms")
+
+    failed = False
+    eager = [name for name in times if name.split(".")[0] in LAZY_MODULES]
+    if eager:
+        print(f"FAIL: imported at startup but should be lazy: {', '.join(sorted(eager)[:5])}")
+        failed = True
+    if best > args.max_ms:
+        print(f"FAIL: startup took {best:.1f} ms, above the {args.max_ms:.0f} ms threshold")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
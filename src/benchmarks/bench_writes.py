@@ -0,0 +1,50 @@
+# Benchmark: sustained workout logging from many threads, committing each insert vs. write-behind group commit
+# Run from the 'src' directory:  python -m benchmarks.bench_writes [--threads N] [--per-thread N]
+import argparse
+import os
+import tempfile
+import threading
+import time
+import db
+
+
+# Function to log 'per_thread' workouts from each of 'threads' threads; returns inserts per second
+def run(threads, per_thread):
+    def log(user_id):
+        for i in range(per_thread):
+            db.log_workout(user_id, "Running", 19000 + i % 365, 30, 300)
+
+    workers = [threading.Thread(target=log, args=(n + 1,)) for n in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    db.flush_writes()  # Count only workouts that are actually committed
+    return threads * per_thread / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare direct and write-behind workout logging")
+    parser.add_argument("--threads", type=int, default=16, help="concurrent loggers")
+    parser.add_argument("--per-thread", type=int, default=500, help="workouts logged by each thread")
+    parser.add_argument("--synchronous", default="FULL", help="SQLite synchronous setting (default: %(default)s)")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("direct", "ack", "delay"):
+            db.configure(os.path.join(tmp, f"{mode}.db"), synchronous=args.synchronous)
+            db.init_db()
+            if mode != "direct":
+                db.enable_write_behind(durability=mode)
+            results[mode] = run(args.threads, args.per_thread)
+            db.close_db()
+
+    for mode, rate in results.items():
+        label = "commit per insert" if mode == "direct" else f"write-behind ({mode})"
+        print(f"{label:24s} {rate:10.0f} inserts/s  ({rate / results['direct']:6.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+# Benchmark suite for the data layer, the analysis aggregation and the input validators
+# Runs headless (no display needed) against a temporary database filled with seeded synthetic data.
+# Run from the 'src' directory:
+#   python -m benchmarks.suite --rows 1000 100000 --output results.json
+#   python -m benchmarks.suite --rows 100000 --baseline results.json   (exits with 1 on a regression)
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("MPLBACKEND", "Agg")  # Never try to open a display
+
+import db, funcs
+from benchmarks import synth
+
+# Minimum time spent measuring each benchmark, in seconds
+MIN_TIME = 0.5
+
+# A benchmark is reported as a regression when it is this much slower than the baseline
+DEFAULT_THRESHOLD = 0.20
+
+
+# Function to call 'func' repeatedly for at least 'min_time' seconds; 'setup' (untimed) runs before each call
+# Returns timing statistics in microseconds per call
+def measure(func, setup=None, min_time=MIN_TIME, max_calls=100000):
+    times = []
+    deadline = time.perf_counter() + min_time
+    while len(times) < max_calls and (len(times) < 3 or time.perf_counter() < deadline):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {
+        "calls": len(times),
+        "mean_us": statistics.fmean(times) * 1e6,
+        "p50_us": times[len(times) // 2] * 1e6,
+        "p99_us": times[min(len(times) - 1, int(len(times) * 0.99))] * 1e6,
+        "ops_per_sec": len(times) / sum(times),
+    }
+
+
+# Function to check analytics.exercise_stats against numpy, group by group, for both fields
+# Raises AssertionError on the first mismatch, so the suite never times a wrong result
+def check_exercise_stats(workouts):
+    import analytics, numpy as np
+
+    for field in analytics.FIELDS:
+        values = getattr(workouts, field)
+        names, counts, means, medians = analytics.exercise_stats(workouts, field)
+        for code, name in enumerate(names):
+            group = values[workouts.codes == code]
+            assert counts[code] == len(group), f"{field} count of {name}: {counts[code]} != {len(group)}"
+            if len(group):
+                assert np.isclose(means[code], group.mean()), f"{field} mean of {name}: {means[code]} != {group.mean()}"
+                assert medians[code] == np.median(group), f"{field} median of {name}: {medians[code]} != {np.median(group)}"
+
+
+# Function to run every benchmark against a database of 'rows' synthetic workouts; returns {name: stats}
+def run_suite(rows, users, seed, tmp, min_time):
+    import analytics, plots
+
+    path = os.path.join(tmp, f"bench_{rows}.db")
+    db.init_db(path)
+    start = time.perf_counter()
+    synth.populate(rows, users, seed)
+    results = {"populate": {"rows": rows, "seconds": time.perf_counter() - start,
+                            "ops_per_sec": rows / (time.perf_counter() - start)}}
+
+    # The most active user (the generator gives user000000 the rounding remainder, so pick by count)
+    con = db.connect_db()
+    user_id, name = con.execute("""SELECT users.user_id, name FROM users JOIN exercise_totals USING (user_id)
+                                   GROUP BY users.user_id ORDER BY SUM(workouts) DESC LIMIT 1""").fetchone()
+    day = con.execute("SELECT date FROM workouts WHERE user_id = ? LIMIT 1", (user_id,)).fetchone()[0]
+    date = funcs.day_to_date(day)
+    uncached = db.clear_caches  # Run before a call to measure the SQL path rather than the cache
+
+    def bench(name, func, setup=None):
+        results[name] = measure(func, setup, min_time)
+
+    bench("check_user", lambda: db.check_user(name), uncached)
+    bench("check_user (cached)", lambda: db.check_user(name))
+    bench("get_user_id", lambda: db.get_user_id(name), uncached)
+    bench("get_avg_stats", lambda: db.get_avg_stats(user_id), uncached)
+    bench("get_avg_stats (cached)", lambda: db.get_avg_stats(user_id))
+    bench("get_workout_data", lambda: db.get_workout_data(user_id))
+    bench("iter_workouts (arrays)", lambda: sum(len(b.days) for b in db.iter_workouts(user_id, chunk_size=50000, arrays=True)))
+    bench("get_daily_calories", lambda: db.get_daily_calories(user_id), uncached)
+    bench("log_workout", lambda: db.log_workout(user_id, "Running", date, 30, 300))
+    # Each delete removes the workout logged just before it (untimed), so the table size stays constant
+    bench("del_workout", lambda: db.del_workout(user_id, "01-01-1990"),
+          lambda: db.log_workout(user_id, "Running", "01-01-1990", 30, 300))
+
+    # The analysis window's aggregation, without any Tk
+    bench("analysis: load_workouts", lambda: analytics.load_workouts(user_id))
+    workouts = analytics.load_workouts(user_id)
+    check_exercise_stats(workouts)
+    # Small cases: one workout per exercise, and values far above the smallest one
+    check_exercise_stats(analytics.from_rows([("Running", 1, 10, 300)]))
+    check_exercise_stats(analytics.from_rows([("a", 1, 10, 100), ("a", 2, 10, 300), ("b", 3, 1, 7)]))
+    bench("analysis: daily_totals", lambda: analytics.daily_totals(workouts))
+    bench("analysis: exercise_stats", lambda: analytics.exercise_stats(workouts))
+    bench("analysis: rolling_average", lambda: analytics.rolling_average(workouts, 30))
+    bench("analysis: plots.prepare", lambda: plots.prepare(user_id), lambda: (uncached(), plots.forget(user_id)))
+    db.close_db()
+    return results
+
+
+# Function to benchmark the single-value and batch validators in funcs (independent of database size)
+def run_validators(min_time):
+    dates = [funcs.day_to_date(day) for day, _ in zip(range(16436, 20000, 3), range(1000))] * 10
+    numbers = [str(n) for n in range(1, 10001)]
+    return {
+        "funcs.check_date": measure(lambda: funcs.check_date("15-06-2024"), min_time=min_time),
+        "funcs.check_date (invalid)": measure(lambda: funcs.check_date("31-02-2024"), min_time=min_time),
+        "funcs.check_pos_num": measure(lambda: funcs.check_pos_num("42"), min_time=min_time),
+        "funcs.check_pos_num (invalid)": measure(lambda: funcs.check_pos_num("abc"), min_time=min_time),
+        "funcs.check_empty": measure(lambda: funcs.check_empty("Running"), min_time=min_time),
+        "funcs.check_dates (10k)": measure(lambda: funcs.check_dates(dates), min_time=min_time),
+        "funcs.check_pos_nums (10k)": measure(lambda: funcs.check_pos_nums(numbers), min_time=min_time),
+    }
+
+
+# Function to compare results with a baseline file; returns the list of regressions found
+def compare(results, baseline, threshold):
+    regressions = []
+    for group, benchmarks in results["results"].items():
+        for name, stats in benchmarks.items():
+            old = baseline.get("results", {}).get(group, {}).get(name)
+            if not old or "ops_per_sec" not in old:
+                continue
+            change = stats["ops_per_sec"] / old["ops_per_sec"] - 1
+            flag = ""
+            if change < -threshold:
+                flag = "  REGRESSION"
+                regressions.append(f"{group}/{name}")
+            print(f"  {group:14s} {name:32s} {old['ops_per_sec']:12.1f} -> {stats['ops_per_sec']:12.1f} ops/s ({change:+.0%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GetFit benchmark suite")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100000],
+                        help="database sizes to benchmark (1K to 10M)")
+    parser.add_argument("--users", type=int, default=100, help="users in the synthetic data")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic data")
+    parser.add_argument("--min-time", type=float, default=MIN_TIME, help="seconds to spend on each benchmark")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with the results in this JSON file")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="slowdown that counts as a regression (default: %(default)s)")
+    args = parser.parse_args()
+
+    results = {
+        "meta": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                 "platform": platform.platform(), "seed": args.seed, "users": args.users,
+                 "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "results": {"validators": run_validators(args.min_time)},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            print(f"Benchmarking with {rows} rows...", file=sys.stderr)
+            results["results"][f"rows={rows}"] = run_suite(rows, args.users, args.seed, tmp, args.min_time)
+
+    for group, benchmarks in results["results"].items():
+        print(group)
+        for name, stats in benchmarks.items():
+            detail = f"p50 {stats['p50_us']:10.1f} us  p99 {stats['p99_us']:10.1f} us" if "p50_us" in stats else ""
+            print(f"  {name:32s} {stats['ops_per_sec']:12.1f} ops/s  {detail}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        print(f"Compared with {args.baseline}:")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+# Seeded synthetic workout data for benchmarks: the same seed always produces the same rows
+# Run from the 'src' directory to write a file for the importer:
+#   python -m benchmarks.synth --rows 1000000 --users 1000 workouts.csv
+import argparse
+import csv
+import math
+import random
+import sys
+
+# Exercises with how often they are picked and calories burned per minute (roughly MET-based)
+EXERCISES = [
+    ("Running", 0.25, 11.0),
+    ("Cycling", 0.20, 8.5),
+    ("Walking", 0.15, 4.5),
+    ("Swimming", 0.10, 9.5),
+    ("Weight Training", 0.12, 6.0),
+    ("Rowing", 0.06, 8.0),
+    ("Yoga", 0.07, 3.5),
+    ("HIIT", 0.05, 12.5),
+]
+
+# First day of generated histories (01-01-2015) and how many days they span
+START_DAY = 16436
+SPAN_DAYS = 10 * 365
+
+
+# Function to generate 'rows' workouts spread over 'users' users, as (user name, exercise, day, duration, calories)
+# Users log different amounts (a few very active users, many occasional ones) and each history is in date order
+def generate(rows, users=100, seed=0):
+    rng = random.Random(seed)
+    names = [name for name, _, _ in EXERCISES]
+    weights = [weight for _, weight, _ in EXERCISES]
+    burn_rate = {name: rate for name, _, rate in EXERCISES}
+
+    # Share of all rows each user gets: a heavy-tailed (Pareto) spread
+    shares = [rng.paretovariate(1.5) for _ in range(users)]
+    total = sum(shares)
+    counts = [int(rows * share / total) for share in shares]
+    counts[0] += rows - sum(counts)  # Give the rounding remainder to the first user
+
+    for user, count in enumerate(counts):
+        name = f"user{user:06d}"
+        favourite = rng.choices(names, weights)[0]  # Everyone has an exercise they do more often
+        day = START_DAY + rng.randrange(SPAN_DAYS // 2)
+        gap = max(SPAN_DAYS / max(count, 1), 1 / 3)  # Average days between workouts
+        for _ in range(count):
+            day += int(rng.expovariate(1 / gap)) if gap >= 1 else (rng.random() < gap)
+            exercise = favourite if rng.random() < 0.4 else rng.choices(names, weights)[0]
+            duration = max(5, min(240, int(rng.lognormvariate(math.log(40), 0.45))))
+            calories = max(1, int(duration * burn_rate[exercise] * rng.uniform(0.8, 1.2)))
+            yield name, exercise, day, duration, calories
+
+
+# Function to load generated workouts into the database configured in db.py; returns the number of rows
+def populate(rows, users=100, seed=0):
+    import db
+    return db.log_workouts_bulk(generate(rows, users, seed), batch_size=50000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write seeded synthetic workouts as CSV (DD-MM-YYYY dates)")
+    parser.add_argument("path", nargs="?", help="output file (default: standard output)")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import funcs
+    out = open(args.path, "w", newline="", encoding="utf-8") if args.path else sys.stdout
+    with out:
+        writer = csv.writer(out)
+        writer.writerow(["name", "exercise", "date", "duration", "calories"])
+        for name, exercise, day, duration, calories in generate(args.rows, args.users, args.seed):
+            writer.writerow([name, exercise, funcs.day_to_date(day), duration, calories])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import collections
+import functools
+import threading
+import time
+
+# Returned by Cache.get() when a key isn't cached (None is a valid cached value)
+MISSING = object()
+
+
+# Thread-safe least-recently-used cache whose entries also expire 'ttl' seconds after they were stored
+class Cache:
+    def __init__(self, name, maxsize=1024, ttl=60.0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()  # key -> (expiry time, value), least recently used first
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, so a value read from the database before an invalidation
+        # isn't stored after it (the write that caused the invalidation may have changed it)
+        self._generation = 0
+
+    # Function to return the cached value for 'key', or MISSING (counts as a hit or a miss)
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]  # Expired
+            self.misses += 1
+            return MISSING
+
+    # Function to store 'value' for 'key'; skipped if the cache was invalidated since 'generation' was read
+    def put(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    # Function to drop one key (or every key if none is given)
+    def invalidate(self, *keys):
+        with self._lock:
+            self._generation += 1
+            if not keys:
+                self._entries.clear()
+            for key in keys:
+                self._entries.pop(key, None)
+
+    # Function to return the current generation, to pass to put() after reading from the database
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    # Decorator: cache a function's result by its positional arguments
+    def read_through(self, func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            value = self.get(args)
+            if value is MISSING:
+                generation = self.generation()
+                value = func(*args)
+                self.put(args, value, generation)
+            return value
+        wrapper.cache = self
+        return wrapper
+
+    # Function to return the hit/miss counters and current size
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
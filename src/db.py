@@ -1,111 +1,922 @@
-import sqlite3 as sql
+import array
+import atexit
+import collections
+import contextlib
+import heapq
+import itertools
+import os
+import threading
+import traceback
+import archive, cache, funcs, pool, writer
+import shards as shards_module
 
-# Function to connect to the SQLite database (GetFit.db)
-def connect_db():
-    return sql.connect("GetFit.db")
+# Path of the SQLite database file used by the app
+DB_PATH = "GetFit.db"
 
-# Function to create the necessary tables if they don't already exist
-def create_tables():
-    con = connect_db()  # Connect to the database
+# Default folder for sharded storage (see configure)
+SHARDS_PATH = "GetFit-shards"
+
+# Folder for archived workouts (see archive_workouts): inside a sharded folder, or next to a database file
+ARCHIVE_FOLDER = "archive"
+
+# Shared connection pool; every function below borrows the calling thread's connection from it
+# In sharded mode this is the directory database's pool, and workouts are read from and written to '_shards'
+_pool = pool.register(pool.ConnectionPool(DB_PATH))
+_shards = None
+_initialised = False  # Set once init_db() has created/upgraded the tables of the current database
+
+# In-process caches in front of the read functions below. The write functions invalidate exactly the entries
+# they affect; the time limit only matters for changes made by other processes (e.g. a command-line import)
+CACHE_TTL = 30.0
+_user_ids = cache.Cache("user_ids", maxsize=4096, ttl=CACHE_TTL)          # name -> user ID
+_versions = cache.Cache("data_versions", maxsize=1024, ttl=CACHE_TTL)     # user ID -> data version
+_stats = cache.Cache("stats", maxsize=1024, ttl=CACHE_TTL)                # user ID -> get_avg_stats()
+_daily = cache.Cache("daily_calories", maxsize=256, ttl=CACHE_TTL)        # user ID -> get_daily_calories()
+_exercises = cache.Cache("exercise_calories", maxsize=256, ttl=CACHE_TTL) # user ID -> get_exercise_avg_calories()
+_archives = cache.Cache("archives", maxsize=1024, ttl=CACHE_TTL)          # user ID -> archive generation (0: none)
+_per_user_caches = (_versions, _stats, _daily, _exercises, _archives)
+
+# Optional write-behind queue for log_workout (see enable_write_behind); None means every call commits directly
+_write_behind = None
+
+# A change to one user's workouts of one exercise on one day, published once it is committed (see subscribe):
+#   seq        number of the change; changes are numbered 1, 2, 3... in the order they are published
+#   workouts, duration, calories   amounts added (negative when workouts are deleted)
+WorkoutDelta = collections.namedtuple("WorkoutDelta", "seq user_id day exercise workouts duration calories")
+_subscribers = []
+_changes = 0  # Number of the last change published
+_publish_lock = threading.Lock()
+_unnumbered = 0  # Changes being made while nobody was subscribed, which won't be published (see _changing)
+_unnumbered_done = threading.Condition(_publish_lock)
+
+# Function to point the data layer at another database file and/or durability level
+# ('synchronous' is SQLite's fsync policy: OFF, NORMAL or FULL)
+# With 'shards' > 0, 'path' is a folder holding a directory database and that many shard databases (see shards.py):
+# each user's workouts live in one shard, so writes for users on different shards don't wait for each other.
+# An existing folder keeps the shards it already has (use rebalance_shards to add more)
+def configure(path=DB_PATH, synchronous="NORMAL", cached_statements=256, shards=0):
+    global _pool, _shards, _initialised
+    disable_write_behind()  # Queued workouts belong to the previous database
+    _close_pools()  # Release the connections to the previous database
+    if shards:
+        _shards = shards_module.ShardSet(path, shards, synchronous=synchronous, cached_statements=cached_statements,
+                                         setup=create_tables)
+        _pool = _shards.directory
+    else:
+        _shards = None
+        _pool = pool.register(pool.ConnectionPool(path, synchronous=synchronous, cached_statements=cached_statements))
+    _initialised = False
+    clear_caches()  # Cached results belong to the previous database
+
+def _close_pools():
+    if _shards is not None:
+        _shards.close_all()
+    _pool.close_all()
+    archive.load.cache_clear()  # Unmap archive files (once no arrays use them any more)
+
+# Function to connect to the SQLite database (GetFit.db); the connection is pooled, so callers must not close it
+# In sharded mode, pass 'user_id' to get the shard holding that user's workouts; without it, the directory
+# database (users) is returned
+def connect_db(user_id=None):
+    if user_id is None or _shards is None:
+        return _pool.get()
+    return _shards.get(user_id)
+
+# Function to return (path, shards) of the current database, e.g. for other processes to open it with init_db
+def location():
+    return (_shards.path, len(_shards.pools)) if _shards is not None else (_pool.path, 0)
+
+# Function to return the folder holding the current database's archive files
+def _archive_folder():
+    if _shards is not None:
+        return os.path.join(_shards.path, ARCHIVE_FOLDER)
+    return os.path.splitext(_pool.path)[0] + "-" + ARCHIVE_FOLDER
+
+# Function to return the calling thread's connection to every database holding workouts (one unless sharded)
+def _workout_databases():
+    return [shard.get() for shard in _shards.pools] if _shards is not None else [_pool.get()]
+
+# Function to call 'func(connection)' on every database holding workouts, in parallel when sharded
+# (used by queries that cover all users); returns the results in shard order
+def _fan_out(func):
+    return _shards.fan_out(func) if _shards is not None else [func(_pool.get())]
+
+# Function to open the database and create or upgrade its tables; call once at startup before any other function
+# Importing this module has no side effects, so tools that never touch the database don't pay for this
+# 'shards' > 0 switches to sharded storage in the folder 'path', 0 to a single file (see configure);
+# by default the current mode is kept
+def init_db(path=None, shards=None):
+    global _initialised
+    current = _shards.path if _shards is not None else _pool.path
+    if (path is not None and path != current) or (shards is not None and bool(shards) != (_shards is not None)):
+        configure(path or (SHARDS_PATH if shards else DB_PATH), synchronous=_pool.synchronous, shards=shards or 0)
+    if not _initialised:
+        for con in _workout_databases():
+            create_tables(con)
+        _initialised = True
+
+# Function to drop every cached result (e.g. after changing the database from outside this module)
+def clear_caches():
+    _user_ids.invalidate()
+    for user_cache in _per_user_caches:
+        user_cache.invalidate()
+
+# Function to drop the cached results that depend on one user's workouts
+def _workouts_changed(user_id):
+    for user_cache in _per_user_caches:
+        user_cache.invalidate((user_id,))
+
+# Function to return the hit/miss counters of every cache, as {cache name: {'hits', 'misses', 'size'}}
+def cache_stats():
+    return {c.name: c.stats() for c in (_user_ids,) + _per_user_caches}
+
+# Function to close all pooled connections (called automatically at exit)
+def close_db():
+    disable_write_behind()
+    _close_pools()
+
+# Function to make log_workout queue its inserts for a single writer thread that commits them in groups,
+# so many concurrent loggers share one commit (and one fsync) instead of paying for one each.
+# durability='ack': log_workout returns once its workout is committed (same guarantee as without the queue)
+# durability='delay': log_workout returns at once; workouts are committed within 'max_delay' seconds
+# A full queue (max_queue workouts) makes log_workout wait. Call flush_writes() to wait for everything queued
+# In sharded mode every shard gets its own queue and writer thread, so shards commit in parallel
+def enable_write_behind(durability="ack", max_batch=1000, max_delay=0.01, max_queue=100000):
+    global _write_behind
+    disable_write_behind()
+    queues = [writer.WriteBehind(_commit_workouts, durability=durability, max_batch=max_batch,
+                                 max_delay=max_delay, max_queue=max_queue)
+              for _ in (_shards.pools if _shards is not None else [None])]
+    _write_behind = queues[0] if len(queues) == 1 else writer.Partitioned(queues, lambda row: _shards.shard_of(row[0]))
+
+# Function to commit everything queued by write-behind mode and switch back to direct writes
+def disable_write_behind():
+    global _write_behind
+    if _write_behind is not None:
+        queued, _write_behind = _write_behind, None
+        queued.close()
+
+# Function to wait until every queued workout has been committed (does nothing without write-behind mode)
+def flush_writes():
+    if _write_behind is not None:
+        _write_behind.flush()
+
+# Function to insert a group of workout rows in one transaction; called by the write-behind writer thread
+# (in sharded mode each writer thread only gets rows for its own shard)
+def _commit_workouts(rows):
+    con = connect_db(rows[0][0])
+    with _changing(con, {row[0] for row in rows}) as changes:
+        con.executemany("""INSERT INTO workouts (user_id, exercise, date, duration, calories)
+                           VALUES (?, ?, ?, ?, ?)""", rows)
+        if changes is not None:
+            changes.extend((user_id, date, exercise, 1, duration, calories)
+                           for user_id, exercise, date, duration, calories in rows)
+
+# Function to call 'callback(delta)' with a WorkoutDelta for every workout logged with log_workout, and for every
+# exercise of a day deleted with del_workout, once the change is committed. Callbacks run on the thread that made
+# the change (e.g. the write-behind writer thread), so they should only hand the delta over, e.g. to a queue.
+# Bulk imports, archiving and other processes publish nothing; compare get_data_version to notice those
+def subscribe(callback):
+    with _publish_lock:
+        _subscribers.append(callback)
+        # Changes already under way aren't published: wait for them, so data read from now on includes them
+        _unnumbered_done.wait_for(lambda: not _unnumbered)
+
+# Function to stop calling a callback given to subscribe
+def unsubscribe(callback):
+    with _publish_lock:
+        if callback in _subscribers:
+            _subscribers.remove(callback)
+
+# Function to return the number of the last change published, 0 if none. Data read after this number was
+# taken includes every change up to it; data read before it was taken includes none after it
+# (while anyone is subscribed, changes are committed and numbered under _publish_lock, so no reader can see a
+# change before it is numbered, and this waits for a change being committed)
+def change_count():
+    with _publish_lock:
+        return _changes
+
+# Function (a context manager) to change workouts on 'con' in one transaction, committed when the block ends
+# (rolled back if it raises); the caches of 'user_ids' are cleared once it is committed. Yields a list for the
+# changes as (user_id, day, exercise, workouts, duration, calories), published once committed, or None if
+# nobody is subscribed: then there is nothing to work out, and the commit doesn't wait for any other change.
+# Only the commit itself holds _publish_lock, so slow work in the block (e.g. writing archive files) doesn't
+@contextlib.contextmanager
+def _changing(con, user_ids):
+    global _unnumbered
+    with _publish_lock:
+        changes = [] if _subscribers else None
+        if changes is None:
+            _unnumbered += 1
+    try:
+        try:
+            yield changes
+            if changes is None:
+                con.commit()
+            else:
+                with _publish_lock:
+                    con.commit()
+                    for user_id in user_ids:
+                        _workouts_changed(user_id)
+                    _publish(changes)
+        except BaseException:
+            con.rollback()
+            raise
+        if changes is None:
+            for user_id in user_ids:
+                _workouts_changed(user_id)
+    finally:
+        if changes is None:
+            with _publish_lock:
+                _unnumbered -= 1
+                if not _unnumbered:
+                    _unnumbered_done.notify_all()
+
+# Function to publish committed changes, given as (user_id, day, exercise, workouts, duration, calories)
+# Call with _publish_lock held since before the changes were committed (see _changing)
+def _publish(changes):
+    global _changes
+    if not _subscribers:
+        return  # Nobody is listening any more, so don't even number the changes
+    # Every subscriber sees the changes in the order of their numbers
+    for user_id, day, exercise, workouts, duration, calories in changes:
+        _changes += 1
+        delta = WorkoutDelta(_changes, user_id, day, exercise, workouts, duration, calories)
+        for callback in _subscribers:
+            try:
+                callback(delta)
+            except Exception:
+                traceback.print_exc()  # The change is already committed, so don't fail the caller
+
+# Make sure queued workouts reach the database when the program exits (runs before the pools are closed)
+atexit.register(disable_write_behind)
+
+# Version of the schema created by this module, stored in SQLite's 'user_version' pragma
+# 0: original schema (dates stored as DD-MM-YYYY text, no indexes)
+# 1: dates stored as day numbers (days since 01-01-1970), indexed by (user_id, date), unique user names
+# 2: per-day and per-exercise rollup tables, kept up to date by triggers on 'workouts'
+# 3: per-user data version (last workout ID and number of deletes), so caches can tell when data changed
+# 4: per-user archive generation and totals, for workouts moved into columnar archive files
+SCHEMA_VERSION = 4
+
+# Function to create the necessary tables if they don't already exist, and upgrade older databases
+# 'con' picks the database (e.g. one shard); by default it's the current thread's connection
+def create_tables(con=None):
+    con = con or connect_db()  # Connect to the database
     c = con.cursor()    # Create a cursor to execute SQL commands
     # Create the 'users' table to store user information
     c.execute("""CREATE TABLE IF NOT EXISTS users(
         user_id integer PRIMARY KEY AUTOINCREMENT,
         name text NOT NULL)""")  # Username cannot be null
-    # Create the 'workouts' table to store workout data
-    c.execute("""CREATE TABLE IF NOT EXISTS workouts(
+    # Only a brand new database gets the latest 'workouts' table directly; existing ones are migrated below
+    c.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'workouts'")
+    if c.fetchone()[0] == 0:
+        # Create the 'workouts' table to store workout data
+        c.execute("""CREATE TABLE workouts(
+            workoutId integer PRIMARY KEY AUTOINCREMENT,
+            user_id integer,
+            exercise text NOT NULL,
+            date integer,
+            duration integer,
+            calories integer,
+            FOREIGN KEY(user_id) REFERENCES users(user_id))""")  # Links to 'users' table
+    con.commit()  # Save the changes
+    c.close()
+    migrate(con)
+
+# Function to bring the database up to SCHEMA_VERSION; each step runs in its own transaction
+def migrate(con=None):
+    con = con or connect_db()
+    for version in range(1, SCHEMA_VERSION + 1):
+        con.execute("BEGIN IMMEDIATE")  # Take the write lock so two processes can't migrate at once
+        try:
+            if con.execute("PRAGMA user_version").fetchone()[0] < version:
+                _MIGRATIONS[version](con)
+                con.execute(f"PRAGMA user_version = {version}")
+            con.commit()
+        except BaseException:
+            con.rollback()
+            raise
+
+# Version 1: convert dates to sortable day numbers and add the indexes used by per-user queries
+def _migrate_to_v1(con):
+    # Dates that can't be parsed are kept as they are, so nothing is lost
+    def to_day(date):
+        try:
+            return funcs.date_to_day(date)
+        except ValueError:
+            return date
+    con.create_function("to_day", 1, to_day, deterministic=True)
+    # SQLite can't change a column's type in place, so copy into a new table with an integer 'date'
+    con.execute("""CREATE TABLE workouts_v1(
         workoutId integer PRIMARY KEY AUTOINCREMENT,
         user_id integer,
         exercise text NOT NULL,
-        date text,
+        date integer,
         duration integer,
         calories integer,
-        FOREIGN KEY(user_id) REFERENCES users(user_id))""")  # Links to 'users' table
-    con.commit()  # Save the changes
-    con.close()   # Close the database connection
+        FOREIGN KEY(user_id) REFERENCES users(user_id))""")
+    con.execute("""INSERT INTO workouts_v1 (workoutId, user_id, exercise, date, duration, calories)
+                   SELECT workoutId, user_id, exercise, to_day(date), duration, calories FROM workouts""")
+    con.execute("DROP TABLE workouts")
+    con.execute("ALTER TABLE workouts_v1 RENAME TO workouts")
+    # Names must be unique from now on: move workouts of duplicate accounts onto the oldest one
+    con.execute("""UPDATE workouts SET user_id = (
+                       SELECT MIN(u2.user_id) FROM users u1 JOIN users u2 ON u2.name = u1.name
+                       WHERE u1.user_id = workouts.user_id)
+                   WHERE user_id IN (SELECT user_id FROM users WHERE user_id NOT IN (
+                       SELECT MIN(user_id) FROM users GROUP BY name))""")
+    con.execute("DELETE FROM users WHERE user_id NOT IN (SELECT MIN(user_id) FROM users GROUP BY name)")
+    con.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_name ON users(name)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_workouts_user_date ON workouts(user_id, date)")
+
+# Version 2: rollup tables holding running totals, so stats and charts read one row per day or exercise
+def _migrate_to_v2(con):
+    # (user, day) -> number of workouts, total duration and total calories
+    con.execute("""CREATE TABLE IF NOT EXISTS daily_totals(
+        user_id integer,
+        date integer,
+        workouts integer NOT NULL,
+        duration integer NOT NULL,
+        calories integer NOT NULL,
+        PRIMARY KEY(user_id, date)) WITHOUT ROWID""")
+    # (user, exercise) -> number of workouts, total duration and total calories
+    con.execute("""CREATE TABLE IF NOT EXISTS exercise_totals(
+        user_id integer,
+        exercise text,
+        workouts integer NOT NULL,
+        duration integer NOT NULL,
+        calories integer NOT NULL,
+        PRIMARY KEY(user_id, exercise)) WITHOUT ROWID""")
+    # Every write path (log_workout, del_workout, bulk imports, other tools) goes through these triggers.
+    # Rows without a date (possible only in very old databases) can't be keyed by day and are left out
+    con.execute("""CREATE TRIGGER IF NOT EXISTS workouts_rollup_insert AFTER INSERT ON workouts
+                   WHEN NEW.date IS NOT NULL BEGIN
+        INSERT INTO daily_totals (user_id, date, workouts, duration, calories)
+        VALUES (NEW.user_id, NEW.date, 1, coalesce(NEW.duration, 0), coalesce(NEW.calories, 0))
+        ON CONFLICT(user_id, date) DO UPDATE SET workouts = workouts + 1,
+            duration = duration + excluded.duration, calories = calories + excluded.calories;
+        INSERT INTO exercise_totals (user_id, exercise, workouts, duration, calories)
+        VALUES (NEW.user_id, NEW.exercise, 1, coalesce(NEW.duration, 0), coalesce(NEW.calories, 0))
+        ON CONFLICT(user_id, exercise) DO UPDATE SET workouts = workouts + 1,
+            duration = duration + excluded.duration, calories = calories + excluded.calories;
+    END""")
+    con.execute("""CREATE TRIGGER IF NOT EXISTS workouts_rollup_delete AFTER DELETE ON workouts
+                   WHEN OLD.date IS NOT NULL BEGIN
+        UPDATE daily_totals SET workouts = workouts - 1,
+            duration = duration - coalesce(OLD.duration, 0), calories = calories - coalesce(OLD.calories, 0)
+        WHERE user_id = OLD.user_id AND date = OLD.date;
+        DELETE FROM daily_totals WHERE user_id = OLD.user_id AND date = OLD.date AND workouts <= 0;
+        UPDATE exercise_totals SET workouts = workouts - 1,
+            duration = duration - coalesce(OLD.duration, 0), calories = calories - coalesce(OLD.calories, 0)
+        WHERE user_id = OLD.user_id AND exercise = OLD.exercise;
+        DELETE FROM exercise_totals WHERE user_id = OLD.user_id AND exercise = OLD.exercise AND workouts <= 0;
+    END""")
+    _fill_rollups(con)
+
+# Function to recompute both rollup tables from the 'workouts' table (inside the caller's transaction)
+def _fill_rollups(con):
+    con.execute("DELETE FROM daily_totals")
+    con.execute("DELETE FROM exercise_totals")
+    con.execute("""INSERT INTO daily_totals (user_id, date, workouts, duration, calories)
+                   SELECT user_id, date, COUNT(*), coalesce(SUM(duration), 0), coalesce(SUM(calories), 0)
+                   FROM workouts WHERE date IS NOT NULL GROUP BY user_id, date""")
+    con.execute("""INSERT INTO exercise_totals (user_id, exercise, workouts, duration, calories)
+                   SELECT user_id, exercise, COUNT(*), coalesce(SUM(duration), 0), coalesce(SUM(calories), 0)
+                   FROM workouts WHERE date IS NOT NULL GROUP BY user_id, exercise""")
+
+# Version 3: a per-user version stamp that changes whenever one of the user's workouts is added or deleted
+def _migrate_to_v3(con):
+    con.execute("""CREATE TABLE IF NOT EXISTS data_versions(
+        user_id integer PRIMARY KEY,
+        last_workout integer NOT NULL DEFAULT 0,
+        deletes integer NOT NULL DEFAULT 0)""")
+    con.execute("""CREATE TRIGGER IF NOT EXISTS workouts_version_insert AFTER INSERT ON workouts BEGIN
+        INSERT INTO data_versions (user_id, last_workout) VALUES (NEW.user_id, NEW.workoutId)
+        ON CONFLICT(user_id) DO UPDATE SET last_workout = max(last_workout, excluded.last_workout);
+    END""")
+    con.execute("""CREATE TRIGGER IF NOT EXISTS workouts_version_delete AFTER DELETE ON workouts BEGIN
+        INSERT INTO data_versions (user_id, deletes) VALUES (OLD.user_id, 1)
+        ON CONFLICT(user_id) DO UPDATE SET deletes = deletes + 1;
+    END""")
+    con.execute("""INSERT OR IGNORE INTO data_versions (user_id, last_workout)
+                   SELECT user_id, MAX(workoutId) FROM workouts GROUP BY user_id""")
+
+# Version 4: which archive file holds a user's archived workouts (see archive_workouts), and their totals
+# The rollup tables only cover the 'workouts' table, so stats add these totals to theirs
+def _migrate_to_v4(con):
+    con.execute("""CREATE TABLE IF NOT EXISTS archives(
+        user_id integer PRIMARY KEY,
+        generation integer NOT NULL,
+        workouts integer NOT NULL,
+        duration integer NOT NULL,
+        calories integer NOT NULL)""")
+
+# Migration steps, keyed by the version they upgrade to
+_MIGRATIONS = {1: _migrate_to_v1, 2: _migrate_to_v2, 3: _migrate_to_v3, 4: _migrate_to_v4}
+
+# Function to rebuild the rollup tables from scratch (e.g. after the 'workouts' table was edited by hand)
+def rebuild_rollups():
+    def rebuild(con):
+        with con:
+            _fill_rollups(con)
+    _fan_out(rebuild)
+    clear_caches()
 
 # Function to check if a user with the given name already exists in the database
 def check_user(name):
-    con = connect_db()  # Connect to the database
-    c = con.cursor()
-    # Query to find if the username exists
-    c.execute("SELECT name FROM users WHERE name = ?", (name,))
-    result = c.fetchone()  # Fetch the first matching record
-    con.close()  # Close the database connection
+    # Shares get_user_id's cached lookup, so logging in right after this check costs no extra query
     # Return True if the user is found, else return None
-    return True if result is not None else None
+    return True if get_user_id(name) is not None else None
 
 # Function to register a new user in the 'users' table and return their unique user ID
 def user_registration(name):
     con = connect_db()  # Connect to the database
-    c = con.cursor()
-    # Insert a new user record with the given name
-    c.execute("INSERT INTO users (name) VALUES (?)", (name,))
-    con.commit()  # Save the changes
+    # 'with con' commits on success and rolls back on error, so the pooled connection is never left mid-transaction
+    with con:
+        # Insert a new user record with the given name (and, if sharded, the shard that will hold their workouts)
+        if _shards is None:
+            c = con.execute("INSERT INTO users (name) VALUES (?)", (name,))
+        else:
+            c = con.execute("INSERT INTO users (name, shard) VALUES (?, ?)", (name, _shards.place(name)))
     user_id = c.lastrowid  # Get the auto-generated user ID for the new record
+    _user_ids.invalidate((name,))
+    _user_ids.put((name,), user_id)  # The login that follows registration needs no query
     return user_id  # Return the user ID to the calling function
 
 # Function to log a workout in the 'workouts' table for the specified user
 def log_workout(user_id, exercise, date, duration, calories):
-    con = connect_db()  # Connect to the database
-    c = con.cursor()
-    # Insert a new workout record with the provided details
-    c.execute("""INSERT INTO workouts (user_id, exercise, date, duration, calories)
-                 VALUES (?, ?, ?, ?, ?)""",
-                 (user_id, exercise, date, duration, calories))
-    con.commit()  # Save the changes
-    con.close()   # Close the database connection
+    date = funcs.date_to_day(date)  # Dates are stored as day numbers so they sort and index correctly
+    if _write_behind is not None:
+        _write_behind.submit((user_id, exercise, date, duration, calories))  # Committed by the writer thread
+        return
+    con = connect_db(user_id)  # Connect to the database (the user's shard, if sharded)
+    with _changing(con, [user_id]) as changes:  # Commit on success, roll back on error
+        # Insert a new workout record with the provided details
+        con.execute("""INSERT INTO workouts (user_id, exercise, date, duration, calories)
+                       VALUES (?, ?, ?, ?, ?)""",
+                    (user_id, exercise, date, duration, calories))
+        if changes is not None:
+            changes.append((user_id, date, exercise, 1, duration, calories))
+
+# Function to insert many workouts in one transaction, 'batch_size' rows per executemany call
+# Each row is (user, exercise, date, duration, calories); 'user' is either a user ID or a user name,
+# and names that aren't registered yet are registered on the fly. Returns the number of rows inserted
+# Raises ValueError (and inserts nothing) if a user ID doesn't belong to a registered user
+# In sharded mode each shard gets its own transaction; they are all committed at the end, or all rolled back
+def log_workouts_bulk(rows, batch_size=10000):
+    rows = iter(rows)
+    user_ids = {}  # user name -> user ID, so each name is looked up once per import
+    targets = {}  # user ID -> connection to the database holding their workouts
+    con = connect_db()  # Connect to the database (the directory, if sharded)
+    register = ("INSERT OR IGNORE INTO users (name) VALUES (?)" if _shards is None else
+                "INSERT OR IGNORE INTO users (name, shard) VALUES (?, ?)")
+    count = 0
+    # One transaction per database for the whole import: a single commit, and nothing is kept if it fails
+    touched = {con}
+    try:
+        while True:
+            batches = collections.defaultdict(list)  # connection -> rows for it
+            for user, exercise, date, duration, calories in itertools.islice(rows, batch_size):
+                if isinstance(user, str):
+                    if user not in user_ids:
+                        con.execute(register, (user,) if _shards is None else (user, _shards.place(user)))
+                        user_ids[user] = con.execute("SELECT user_id FROM users WHERE name = ?", (user,)).fetchone()[0]
+                    user = user_ids[user]
+                target = targets.get(user)
+                if target is None:
+                    if con.execute("SELECT 1 FROM users WHERE user_id = ?", (user,)).fetchone() is None:
+                        raise ValueError(f"no user with user ID {user}")
+                    target = targets[user] = connect_db(user)
+                batches[target].append((user, exercise, funcs.date_to_day(date), duration, calories))
+            if not batches:
+                break
+            for target, batch in batches.items():
+                target.executemany("""INSERT INTO workouts (user_id, exercise, date, duration, calories)
+                                      VALUES (?, ?, ?, ?, ?)""", batch)
+                touched.add(target)
+                count += len(batch)
+        for target in touched:
+            target.commit()
+    except BaseException:
+        for target in touched:
+            target.rollback()
+        raise
+    # Imports can touch any number of users, so start every per-user cache afresh
+    if user_ids:
+        _user_ids.invalidate()
+    for user_cache in _per_user_caches:
+        user_cache.invalidate()
+    return count
 
 # Function to delete workouts for a specific user on a given date
 def del_workout(user_id, date):
-    con = connect_db()  # Connect to the database
-    c = con.cursor()
-    # Delete workout(s) matching the user ID and date
-    c.execute("DELETE FROM workouts WHERE user_id = ? and date = ?", (user_id, date,))
-    con.commit()  # Save the changes
-    con.close()   # Close the database connection
+    date = funcs.date_to_day(date)
+    flush_writes()  # Workouts still queued for this date must be deleted too
+    if get_archive(user_id) is not None:
+        # The date may be archived too: rewrite the archive without it, in the same transaction
+        def change(con, current, changes):
+            if changes is not None:
+                changes.extend(_deleted(user_id, date, _day_totals(con, user_id, date, current)))
+            con.execute("DELETE FROM workouts WHERE user_id = ? and date = ?", (user_id, date,))
+            if current is None or not current.has_day(date):
+                return None
+            # The delete trigger only counts rows deleted from 'workouts', so record this change to the data too
+            con.execute("""INSERT INTO data_versions (user_id, deletes) VALUES (?, 1)
+                           ON CONFLICT(user_id) DO UPDATE SET deletes = deletes + 1""", (user_id,))
+            return [row for row in current.rows() if row[2] != date]
+        _change_archive(user_id, change)
+    else:
+        con = connect_db(user_id)  # Connect to the database (the user's shard, if sharded)
+        with _changing(con, [user_id]) as changes:  # Commit on success, roll back on error
+            if changes is not None:
+                con.execute("BEGIN IMMEDIATE")  # Nothing may be logged for the day between reading and deleting it
+                changes.extend(_deleted(user_id, date, _day_totals(con, user_id, date)))
+            # Delete workout(s) matching the user ID and date
+            con.execute("DELETE FROM workouts WHERE user_id = ? and date = ?", (user_id, date,))
+
+# Function to turn a day's totals (see _day_totals) into the changes that deleting them makes (see _changing)
+def _deleted(user_id, day, totals):
+    return [(user_id, day, exercise, -workouts, -duration, -calories)
+            for exercise, workouts, duration, calories in totals]
+
+# Function to add up a user's workouts on one day (including archived ones in 'current', an archive.Archive)
+# per exercise; returns (exercise, workouts, duration, calories) tuples
+def _day_totals(con, user_id, day, current=None):
+    totals = collections.defaultdict(lambda: [0, 0, 0])
+    rows = con.execute("""SELECT exercise, COUNT(*), coalesce(SUM(duration), 0), coalesce(SUM(calories), 0)
+                          FROM workouts WHERE user_id = ? AND date = ? GROUP BY exercise""", (user_id, day))
+    if current is not None:
+        rows = itertools.chain(rows, ((exercise, 1, duration, calories)
+                                      for _, exercise, _, duration, calories in current.rows(day, day)))
+    for exercise, workouts, duration, calories in rows:
+        total = totals[exercise]
+        total[0] += workouts
+        total[1] += duration
+        total[2] += calories
+    return [(exercise, *total) for exercise, total in totals.items()]
+
+# Function to move every workout dated before 'before' (a date) out of the 'workouts' table into columnar
+# archive files, one per user (see archive.py). Old workouts are rarely changed, and reading them from an
+# archive costs no per-row work: analytics maps a user's archive into memory and uses its columns as they are.
+# The read functions below still include archived workouts. 'user_ids' limits this to some users.
+# Returns the number of workouts archived
+def archive_workouts(before, user_ids=None):
+    before = funcs.date_to_day(before)
+    flush_writes()
+    if user_ids is None:
+        found = _fan_out(lambda con: con.execute("SELECT DISTINCT user_id FROM daily_totals WHERE date < ?",
+                                                 (before,)).fetchall())
+        user_ids = sorted(user_id for rows in found for user_id, in rows)
+    # Rows without a date or numbers (possible only in very old databases) stay where they are; text dates
+    # sort after every day number, so 'date < ?' leaves them out too
+    where = "user_id = ? AND date < ? AND duration IS NOT NULL AND calories IS NOT NULL"
+    archived = 0
+    for user_id in user_ids:
+        def change(con, current, changes):
+            nonlocal archived
+            rows = con.execute(f"""SELECT workoutId, exercise, date, duration, calories FROM workouts
+                                   WHERE {where} ORDER BY date, workoutId""", (user_id, before)).fetchall()
+            if not rows:
+                return None
+            con.execute(f"DELETE FROM workouts WHERE {where}", (user_id, before))
+            archived += len(rows)
+            if current is None:
+                return rows
+            return heapq.merge(current.rows(), rows, key=lambda row: (row[2], row[0]))
+        _change_archive(user_id, change)
+    return archived
+
+# Function to change one user's archive and 'workouts' rows together: 'change(con, current archive or None,
+# changes)' runs with the user's database locked for writing and returns the rows of the new archive (None to
+# keep it); it adds what it changes to 'changes' unless that is None (see _changing).
+# The new file is written under the next generation number before the database switches to it, so a crash at
+# any point leaves either the old archive and rows or the new ones
+def _change_archive(user_id, change):
+    con = connect_db(user_id)
+    folder = _archive_folder()
+    written = None
+    try:
+        with _changing(con, [user_id]) as changes:
+            con.execute("BEGIN IMMEDIATE")
+            row = con.execute("SELECT generation FROM archives WHERE user_id = ?", (user_id,)).fetchone()
+            generation = row[0] if row is not None else 0
+            rows = change(con, archive.load(archive.path(folder, user_id, generation)) if generation else None, changes)
+            if rows is not None:
+                written = archive.path(folder, user_id, generation + 1)
+                workouts, duration, calories = archive.write(written, rows)
+                con.execute("""INSERT OR REPLACE INTO archives (user_id, generation, workouts, duration, calories)
+                               VALUES (?, ?, ?, ?, ?)""", (user_id, generation + 1, workouts, duration, calories))
+    except BaseException:
+        if written is not None and os.path.exists(written):
+            os.remove(written)
+        raise
+    if written is not None:
+        archive.remove_old(folder, user_id, keep=written)
+
+# Function to get the generation of a user's current archive file (0 if they have none)
+@_archives.read_through
+def _archive_generation(user_id):
+    row = connect_db(user_id).execute("SELECT generation FROM archives WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0] if row is not None else 0
+
+# Function to return a user's archived workouts as an archive.Archive, or None if they have none
+def get_archive(user_id):
+    generation = _archive_generation(user_id)
+    if not generation:
+        return None
+    try:
+        return archive.load(archive.path(_archive_folder(), user_id, generation))
+    except FileNotFoundError:
+        # Replaced by another process since the generation was cached; look it up again
+        _archives.invalidate((user_id,))
+        generation = _archive_generation(user_id)
+        return archive.load(archive.path(_archive_folder(), user_id, generation)) if generation else None
+
+# Function to list every registered user as (user ID, name) pairs, in registration order
+def list_users():
+    con = connect_db()  # The directory, if sharded
+    return con.execute("SELECT user_id, name FROM users ORDER BY user_id").fetchall()
+
+# Function to get every user's stats at once, as {user ID: (total workouts, average duration, average calories)}
+# for users with at least one workout; in sharded mode all shards are queried in parallel
+def get_all_stats():
+    def shard_stats(con):
+        return con.execute("""SELECT user_id, SUM(workouts), SUM(duration), SUM(calories) FROM (
+                                  SELECT user_id, workouts, duration, calories FROM exercise_totals
+                                  UNION ALL SELECT user_id, workouts, duration, calories FROM archives)
+                              GROUP BY user_id""").fetchall()
+    stats = {}
+    for rows in _fan_out(shard_stats):
+        for user_id, workouts, duration, calories in rows:
+            if workouts:
+                stats[user_id] = (workouts, duration / workouts, calories / workouts)
+    return stats
+
+# Function to return (users, workouts) for each shard; raises ValueError unless sharded
+def shard_status():
+    return _require_shards().loads()
+
+# Function to move one user's workouts to another shard; returns the number of workouts moved
+def move_user(user_id, shard):
+    flush_writes()  # Queued workouts must land before the user's rows are copied
+    moved = _require_shards().move_user(user_id, shard)
+    _workouts_changed(user_id)
+    return moved
+
+# Function to even out the number of workouts per shard, first adding shards until there are 'count' of them
+# Moves users from overloaded shards to the lightest ones until each is within 'tolerance' of the average;
+# 'on_move(user ID, from shard, to shard, workouts)' is called after each move. Returns the list of moves
+# Run it while no other process is writing: their cached placements would go stale
+def rebalance_shards(count=None, tolerance=0.1, on_move=None):
+    sharded = _require_shards()
+    flush_writes()
+    if count is not None and count > len(sharded.pools):
+        if _write_behind is not None:
+            raise ValueError("disable write-behind before adding shards (it has one queue per shard)")
+        sharded.add_shards(count)
+    moves = sharded.plan_rebalance(tolerance)
+    for user_id, source, target, workouts in moves:
+        sharded.move_user(user_id, target)
+        _workouts_changed(user_id)
+        if on_move is not None:
+            on_move(user_id, source, target, workouts)
+    return moves
+
+def _require_shards():
+    if _shards is None:
+        raise ValueError("the database is not sharded (see db.configure)")
+    return _shards
 
 # Function to retrieve the user ID based on their name
+@_user_ids.read_through
 def get_user_id(name):
     con = connect_db()  # Connect to the database
     c = con.cursor()
     # Query to get the user ID associated with the given name
     c.execute("SELECT user_id FROM users WHERE name = ?", (name,))
     result = c.fetchone()  # Fetch the result
-    con.close()  # Close the database connection
+    c.close()  # Release the cursor (the connection stays open in the pool)
     # Return the user ID if found, else return None
     if result:
         return result[0]
     else:
         return None
 
+# Function to return which of the given user IDs belong to registered users, as a set
+def registered_users(user_ids):
+    con = connect_db()  # The directory, if sharded
+    user_ids = list(user_ids)
+    found = set()
+    for start in range(0, len(user_ids), 500):  # SQLite limits the number of parameters in one statement
+        batch = user_ids[start:start + 500]
+        rows = con.execute(f"SELECT user_id FROM users WHERE user_id IN ({', '.join('?' * len(batch))})", batch)
+        found.update(user_id for user_id, in rows)
+    return found
+
+# Function to get a user's data version: (last workout ID, number of deleted workouts)
+# It changes whenever a workout is logged or deleted, so anything computed from a user's workouts can be reused until then
+@_versions.read_through
+def get_data_version(user_id):
+    con = connect_db(user_id)
+    row = con.execute("SELECT last_workout, deletes FROM data_versions WHERE user_id = ?", (user_id,)).fetchone()
+    return row if row is not None else (0, 0)
+
 # Function to retrieve workout stats (total workouts, average duration, average calories) for a specific user
+@_stats.read_through
 def get_avg_stats(user_id):
-    con = connect_db()  # Connect to the database
+    con = connect_db(user_id)  # Connect to the database (the user's shard, if sharded)
     c = con.cursor()
-    # Query to count total workouts, and calculate average duration and calories for the user
-    c.execute("""SELECT COUNT(*), AVG(duration), AVG(calories) 
-                  FROM workouts 
-                  WHERE user_id = ?""", (user_id,))
-    stats = c.fetchone()  # Fetch the stats from the result
-    con.close()  # Close the database connection
+    # Add up the user's per-exercise totals (one row per exercise instead of one per workout)
+    # and the totals of their archived workouts
+    c.execute("""SELECT SUM(workouts), SUM(duration), SUM(calories) FROM (
+                     SELECT workouts, duration, calories FROM exercise_totals WHERE user_id = ?
+                     UNION ALL SELECT workouts, duration, calories FROM archives WHERE user_id = ?)""",
+              (user_id, user_id))
+    total_workouts, total_duration, total_calories = c.fetchone()  # Fetch the totals from the result
+    c.close()  # Release the cursor (the connection stays open in the pool)
 
     # Assign default values if no workouts are found (handle None values)
-    total_workouts = stats[0] if stats[0] is not None else 0
-    avg_duration = stats[1] if stats[1] is not None else 0
-    avg_calories = stats[2] if stats[2] is not None else 0
+    if not total_workouts:
+        return 0, 0, 0
+    avg_duration = total_duration / total_workouts
+    avg_calories = total_calories / total_workouts
 
     return total_workouts, avg_duration, avg_calories  # Return the calculated stats
 
-# Function to get all workout data (exercise, date, duration, calories) for a specific user
-def get_workout_data(user_id):
-    con = connect_db()  # Connect to the database
+# Function to get the total calories burned on each day a user worked out, as (date, calories) pairs, oldest first
+@_daily.read_through
+def get_daily_calories(user_id):
+    con = connect_db(user_id)
     c = con.cursor()
-    # Query to fetch all workout details for the user
-    c.execute("SELECT exercise, date, duration, calories FROM workouts WHERE user_id = ?", (user_id,))
-    workout_data = c.fetchall()  # Fetch all matching records
-    con.close()  # Close the database connection
-    return workout_data  # Return the workout data
-
-# Call the function to create tables when the program starts
-create_tables()
+    c.execute("SELECT date, calories FROM daily_totals WHERE user_id = ? ORDER BY date", (user_id,))
+    rows = c.fetchall()
+    c.close()
+    archived = get_archive(user_id)
+    if archived is not None:
+        # Add the archive's per-day totals (workouts logged later can share a day with archived ones)
+        totals = dict(zip(archived.daily[0], archived.daily[3]))
+        for date, calories in rows:
+            totals[date] = totals.get(date, 0) + calories
+        rows = sorted(totals.items(), key=lambda row: (not isinstance(row[0], int), row[0]))
+    daily = [(funcs.day_to_date(date), calories) for date, calories in rows]
+    return daily
+
+# Function to get the average calories burned per workout of each exercise, as (exercise, average) pairs
+@_exercises.read_through
+def get_exercise_avg_calories(user_id):
+    con = connect_db(user_id)
+    c = con.cursor()
+    archived = get_archive(user_id)
+    if archived is None:
+        c.execute("""SELECT exercise, CAST(calories AS REAL) / workouts FROM exercise_totals
+                     WHERE user_id = ? ORDER BY exercise""", (user_id,))
+        averages = c.fetchall()
+        c.close()
+        return averages
+    # Combine the per-exercise totals of the table and the archive before averaging
+    c.execute("SELECT exercise, workouts, calories FROM exercise_totals WHERE user_id = ?", (user_id,))
+    totals = {exercise: [workouts, calories] for exercise, workouts, _, calories in archived.exercise_totals if workouts}
+    for exercise, workouts, calories in c.fetchall():
+        total = totals.setdefault(exercise, [0, 0])
+        total[0] += workouts
+        total[1] += calories
+    c.close()
+    return [(exercise, calories / workouts) for exercise, (workouts, calories) in sorted(totals.items())]
+
+# Function to get the totals the analysis graphs need, from the rollup tables and the archive combined
+# Returns ([(day, workouts, calories)] oldest first, [(exercise, workouts, calories)] sorted by exercise)
+def get_plot_totals(user_id):
+    con = connect_db(user_id)
+    c = con.cursor()
+    # Days that couldn't be converted to day numbers (very old databases) can't be placed on the date axis
+    c.execute("""SELECT date, workouts, calories FROM daily_totals
+                 WHERE user_id = ? AND typeof(date) = 'integer' ORDER BY date""", (user_id,))
+    daily = c.fetchall()
+    c.execute("SELECT exercise, workouts, calories FROM exercise_totals WHERE user_id = ? ORDER BY exercise", (user_id,))
+    exercises = c.fetchall()
+    c.close()
+    archived = get_archive(user_id)
+    if archived is None:
+        return daily, exercises
+    # Add the archive's totals (workouts logged later can share a day or an exercise with archived ones)
+    days = {day: [workouts, calories] for day, workouts, _, calories in zip(*archived.daily)}
+    for day, workouts, calories in daily:
+        total = days.setdefault(day, [0, 0])
+        total[0] += workouts
+        total[1] += calories
+    totals = {exercise: [workouts, calories] for exercise, workouts, _, calories in archived.exercise_totals if workouts}
+    for exercise, workouts, calories in exercises:
+        total = totals.setdefault(exercise, [0, 0])
+        total[0] += workouts
+        total[1] += calories
+    return ([(day, workouts, calories) for day, (workouts, calories) in sorted(days.items())],
+            [(exercise, workouts, calories) for exercise, (workouts, calories) in sorted(totals.items())])
+
+# Function to get workout data (exercise, date, duration, calories) for a specific user, oldest first
+# 'start' and 'end' optionally limit the result to an inclusive date range
+def get_workout_data(user_id, start=None, end=None):
+    # Turn the stored day numbers back into DD-MM-YYYY dates
+    return [(exercise, funcs.day_to_date(day), duration, calories)
+            for exercise, day, duration, calories in get_workout_rows(user_id, start, end)]
+
+# Function to get the same rows as get_workout_data, but with dates left as day numbers (see funcs.date_to_day)
+def get_workout_rows(user_id, start=None, end=None):
+    rows = []
+    for batch in iter_workouts(user_id, start, end, chunk_size=10000):
+        rows.extend(row[1:] for row in batch)  # Drop the workout ID
+    return rows
+
+# A chunk of workouts stored column by column in compact arrays instead of one tuple per row:
+#   ids (64-bit), days, durations and calories (C ints), and codes: the position of each
+#   workout's exercise name in 'exercises', a list of the distinct names in this chunk
+WorkoutBatch = collections.namedtuple("WorkoutBatch", "ids days durations calories codes exercises")
+
+# Function to stream a user's workouts in chunks of at most 'chunk_size' rows, ordered by (date, workoutId)
+# Optional filters: 'start'/'end' (inclusive dates) and 'exercise' (exact name). 'reverse' returns the newest
+# first, so callers that only want recent workouts can stop after the first chunk. 'after' is the (day, workoutId)
+# of the last row already seen, to resume from there (keyset pagination).
+# Each chunk is a list of (workoutId, exercise, day, duration, calories) tuples, or a WorkoutBatch if 'arrays'
+# is true (rows without a day number or with missing values, possible only in very old databases, are skipped).
+# Every chunk is a separate indexed query, so no read transaction is held open between chunks.
+# Archived workouts (see archive_workouts) are merged in, unless 'archived' is false
+def iter_workouts(user_id, start=None, end=None, exercise=None, chunk_size=1000, after=None, reverse=False, arrays=False,
+                  archived=True):
+    # Build the filter from the bounds that were given so the (user_id, date) index can seek straight to them
+    where, params = "user_id = ?", [user_id]
+    if start is not None:
+        start = funcs.date_to_day(start)
+        where += " AND date >= ?"
+        params.append(start)
+    if end is not None:
+        end = funcs.date_to_day(end)
+        where += " AND date <= ?"
+        params.append(end)
+    if exercise is not None:
+        where += " AND exercise = ?"
+        params.append(exercise)
+    direction, compare = ("DESC", "<") if reverse else ("ASC", ">")
+    page = f"""SELECT workoutId, exercise, date, duration, calories FROM workouts
+               WHERE {where} AND (date, workoutId) {compare} (?, ?)
+               ORDER BY date {direction}, workoutId {direction} LIMIT ?"""
+    first = f"""SELECT workoutId, exercise, date, duration, calories FROM workouts
+                WHERE {where} ORDER BY date {direction}, workoutId {direction} LIMIT ?"""
+
+    if after is not None and isinstance(after[0], str):
+        try:
+            after = (funcs.date_to_day(after[0]), after[1])
+        except ValueError:
+            pass  # A legacy text date, stored as is
+
+    def pages(after):
+        con = connect_db(user_id)  # Connect to the database (the user's shard, if sharded)
+        while True:
+            if after is None:
+                rows = con.execute(first, params + [chunk_size]).fetchall()
+            else:
+                rows = con.execute(page, params + [after[0], after[1], chunk_size]).fetchall()
+            if not rows:
+                return
+            after = (rows[-1][2], rows[-1][0])  # Resume after the last row of this chunk
+            yield rows
+            if len(rows) < chunk_size:
+                return
+
+    stored = get_archive(user_id) if archived else None
+    if stored is None or len(stored) == 0:
+        for rows in pages(after):
+            yield _to_batch(rows) if arrays else rows
+        return
+
+    # Merge the archive's rows with the table's in (day, workoutId) order. Archived days are all numbers;
+    # a legacy text 'after' sorts after every number, like it does in SQLite
+    if after is None or isinstance(after[0], int):
+        old = stored.rows(start, end, exercise, after, reverse)
+    else:
+        old = stored.rows(start, end, exercise, reverse=True) if reverse else iter(())
+    merged = heapq.merge(old, itertools.chain.from_iterable(pages(after)), key=_row_order, reverse=reverse)
+    for rows in iter(lambda: list(itertools.islice(merged, chunk_size)), []):
+        yield _to_batch(rows) if arrays else rows
+
+# Function to give the sort key of a (workoutId, exercise, day, duration, calories) row, in SQLite's order:
+# rows without a date first, then day numbers, then legacy text dates
+def _row_order(row):
+    day = row[2]
+    return (0 if day is None else 1 if isinstance(day, int) else 2), day, row[0]
+
+# Function to turn a list of (workoutId, exercise, day, duration, calories) tuples into a WorkoutBatch
+def _to_batch(rows):
+    batch = WorkoutBatch(array.array("q"), array.array("i"), array.array("i"), array.array("i"), array.array("i"), [])
+    codes = {}
+    for workout_id, exercise, day, duration, calories in rows:
+        if not isinstance(day, int) or duration is None or calories is None:
+            continue
+        if exercise not in codes:
+            codes[exercise] = len(batch.exercises)
+            batch.exercises.append(exercise)
+        batch.ids.append(workout_id)
+        batch.days.append(day)
+        batch.durations.append(duration)
+        batch.calories.append(calories)
+        batch.codes.append(codes[exercise])
+    return batch
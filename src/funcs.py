@@ -1,28 +1,14 @@
+import validation  # Fast parsers behind the checks below
+
 # Function to check if the input is a positive integer
 def check_pos_num(val):
-    try:
-        # Attempt to convert the input to an integer
-        val = int(val)
-    except ValueError:
-        # If conversion fails (i.e., the input is not a valid integer), return None
-        return None
-    else:
-        # If the conversion succeeds, check if the value is greater than 0
-        if val > 0:
-            return val  # Return the value if it's positive
-        else:
-            return None  # Return None if the value is 0 or negative
+    # Return the value as an integer if it's a whole number greater than 0, else return None
+    return validation.positive_int(val)
 
 # Function to check if the date is in the correct format (DD-MM-YYYY)
 def check_date(date):
-    import datetime  # Import the datetime module to handle date formatting
-    try:
-        # Try to parse the input date string to ensure it follows the format 'DD-MM-YYYY'
-        datetime.datetime.strptime(date, '%d-%m-%Y')
-        return date  # Return the date if the format is correct
-    except ValueError:
-        # Return None if the date format is incorrect or invalid
-        return None
+    # Return the date if it is a real DD-MM-YYYY date (e.g. not 31-02-2024), else return None
+    return date if validation.parse_day(date, False) is not None else None
 
 # Function to check if a given input is empty
 def check_empty(val):
@@ -32,3 +18,32 @@ def check_empty(val):
     else:
         # Return the input value if it is not empty
         return val
+
+# Function to convert a date into a sortable integer: the number of days since 01-01-1970
+# Accepts DD-MM-YYYY (the format the app uses), ISO YYYY-MM-DD, or an already converted integer
+def date_to_day(date):
+    if date is None or isinstance(date, int):
+        return date  # Nothing to convert
+    day = validation.parse_day(date)
+    if day is None:
+        raise ValueError(f"Unrecognised date: {date!r}")
+    return day
+
+# Function to convert a stored day number back into the DD-MM-YYYY format shown to users
+# Text values (rows written before the date column was converted) are returned unchanged
+def day_to_date(day):
+    import datetime
+    if day is None or isinstance(day, str):
+        return day
+    return (datetime.date(1970, 1, 1) + datetime.timedelta(days=day)).strftime('%d-%m-%Y')
+
+# Function to check a whole column of positive integers at once (used when importing many rows)
+# Returns a list with the integer value, or None, for each input, like check_pos_num
+# (validation.validate_positive_ints also says why each rejected value is invalid)
+def check_pos_nums(values):
+    return validation.validate_positive_ints(values).values
+
+# Function to check a whole column of dates at once, returning the day number (see date_to_day) or None for each
+# (validation.validate_dates also says why each rejected value is invalid)
+def check_dates(values):
+    return validation.validate_dates(values).values
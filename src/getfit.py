@@ -0,0 +1,206 @@
+# Headless command-line entry point for GetFit (the desktop app is main.py)
+# Run from the 'src' directory, e.g.:  python -m getfit import workouts.csv
+import argparse
+import os
+import sys
+import time
+import db
+
+
+# Command: import workouts from a CSV or JSONL file
+def cmd_import(args):
+    import importer
+
+    def on_error(line_num, reason):
+        print(f"{args.path}:{line_num}: {reason}", file=sys.stderr)
+
+    imported, rejected = importer.import_file(args.path, fmt=args.format, batch_size=args.batch_size, on_error=on_error)
+    print(f"Imported {imported} workouts, rejected {rejected} rows")
+    return 1 if rejected else 0
+
+
+# Command: recompute the per-day and per-exercise rollup tables from the raw workouts
+def cmd_rebuild_rollups(args):
+    db.rebuild_rollups()
+    print("Rollup tables rebuilt")
+    return 0
+
+
+# Command: print a user's workout summary (totals, per-exercise averages, streaks)
+def cmd_summary(args):
+    import analytics, funcs
+
+    user_id = db.get_user_id(args.name)
+    if user_id is None:
+        print(f"User {args.name} not found", file=sys.stderr)
+        return 1
+    workouts = analytics.load_workouts(user_id, args.start, args.end)
+    if len(workouts.days) == 0:
+        print("No workout data found")
+        return 0
+
+    print(f"Workouts: {len(workouts.days)}  Minutes: {int(workouts.durations.sum())}  Calories: {int(workouts.calories.sum())}")
+    longest, current = analytics.streaks(workouts)
+    print(f"Longest streak: {longest} days  Latest streak: {current} days")
+    print("Per exercise (calories): count / mean / median")
+    for exercise, count, mean, median in zip(*analytics.exercise_stats(workouts)):
+        print(f"  {exercise:20s} {count:6d} {mean:8.1f} {median:8.1f}")
+    totals = {"day": analytics.daily_totals, "week": analytics.weekly_totals, "month": analytics.monthly_totals}[args.by]
+    print(f"Calories per {args.by} (most recent {args.last}):")
+    periods, sums = totals(workouts)
+    for period, total in list(zip(periods, sums))[-args.last:]:
+        print(f"  {funcs.day_to_date(int(period))}  {int(total)}")
+    return 0
+
+
+# Command: write summaries, per-day CSVs and charts for every user, using several processes
+def cmd_report(args):
+    import report
+
+    def progress(done, total, seconds):
+        rate = done / seconds if seconds else 0
+        remaining = (total - done) / rate if rate else 0
+        print(f"\r{done}/{total} users  {rate:.1f} users/s  about {remaining:.0f}s left ", end="", file=sys.stderr, flush=True)
+
+    def on_error(users, error):
+        print(f"\nFailed for users {', '.join(str(user_id) for user_id, _ in users)}: {error}", file=sys.stderr)
+
+    start = time.perf_counter()
+    try:
+        done, failed = report.run(args.out, workers=args.workers, charts=not args.no_charts, user_ids=args.users,
+                                  restart=args.restart, parquet=args.parquet, progress=progress, on_error=on_error)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"\nReported {done} users in {time.perf_counter() - start:.1f}s"
+          + (f", {failed} failed (run again to retry them)" if failed else ""), file=sys.stderr)
+    return 1 if failed else 0
+
+
+# Command: show how users and workouts are spread over the shards, or move users between them
+def cmd_shards(args):
+    if args.action == "move":
+        if args.name is None or args.shard is None:
+            print("move needs a user name and a shard number", file=sys.stderr)
+            return 2
+        user_id = db.get_user_id(args.name)
+        if user_id is None:
+            print(f"User {args.name} not found", file=sys.stderr)
+            return 1
+        print(f"Moved {db.move_user(user_id, args.shard)} workouts of {args.name} to shard {args.shard}")
+    elif args.action == "rebalance":
+        def on_move(user_id, source, target, workouts):
+            print(f"  user {user_id}: shard {source} -> {target} ({workouts} workouts)")
+        moves = db.rebalance_shards(count=args.count, tolerance=args.tolerance, on_move=on_move)
+        print(f"Moved {len(moves)} users")
+    print("shard  users  workouts")
+    for shard, (users, workouts) in enumerate(db.shard_status()):
+        print(f"{shard:5d} {users:6d} {workouts:9d}")
+    return 0
+
+
+# Command: move old workouts into columnar archive files
+def cmd_archive(args):
+    import datetime
+    before = args.before or (datetime.date.today() - datetime.timedelta(days=args.days)).strftime("%d-%m-%Y")
+    user_ids = None
+    if args.name:
+        user_id = db.get_user_id(args.name)
+        if user_id is None:
+            print(f"User {args.name} not found", file=sys.stderr)
+            return 1
+        user_ids = [user_id]
+    start = time.perf_counter()
+    archived = db.archive_workouts(before, user_ids)
+    print(f"Archived {archived} workouts dated before {before} in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+# Command: serve the data layer over HTTP/JSON (see service.py for the endpoints)
+def cmd_serve(args):
+    import service
+    if args.write_behind:
+        db.enable_write_behind(durability=args.write_behind)
+    service.run(args.host, args.port, workers=args.workers)
+    return 0
+
+
+# Function to build the command-line parser with one sub-command per task
+def build_parser():
+    parser = argparse.ArgumentParser(prog="getfit", description="GetFit command-line tools")
+    parser.add_argument("--db", help="path of the SQLite database (default: %s)" % db.DB_PATH)
+    parser.add_argument("--shards", type=int, default=0,
+                        help="use sharded storage: --db is a folder (default: %s) with this many shard databases "
+                             "when it is created" % db.SHARDS_PATH)
+    parser.add_argument("--metrics", action="store_true",
+                        help="time database calls and print a report to standard error at exit (also enables GET /metrics)")
+    parser.add_argument("--slow-query-ms", type=int, default=100,
+                        help="with --metrics, report SQL statements slower than this (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("import", help="import workouts from a CSV or JSONL file")
+    p.add_argument("path", help="file with columns user_id or name, exercise, date, duration, calories")
+    p.add_argument("--format", choices=("csv", "jsonl"), help="file format (default: from the file extension)")
+    p.add_argument("--batch-size", type=int, default=10000, help="rows per insert batch (default: %(default)s)")
+    p.set_defaults(func=cmd_import)
+
+    p = commands.add_parser("summary", help="print a user's workout totals, averages and streaks")
+    p.add_argument("name", help="user name")
+    p.add_argument("--start", help="only include workouts on or after this date (DD-MM-YYYY)")
+    p.add_argument("--end", help="only include workouts on or before this date (DD-MM-YYYY)")
+    p.add_argument("--by", choices=("day", "week", "month"), default="week", help="period for calorie totals")
+    p.add_argument("--last", type=int, default=8, help="number of periods to show (default: %(default)s)")
+    p.set_defaults(func=cmd_summary)
+
+    p = commands.add_parser("serve", help="run the headless HTTP/JSON service")
+    p.add_argument("--host", default="127.0.0.1", help="address to listen on (default: %(default)s)")
+    p.add_argument("--port", type=int, default=8080, help="port to listen on (default: %(default)s)")
+    p.add_argument("--workers", type=int, default=8, help="database worker threads (default: %(default)s)")
+    p.add_argument("--write-behind", choices=("ack", "delay"),
+                   help="group-commit logged workouts: 'ack' replies after the commit, 'delay' replies at once")
+    p.set_defaults(func=cmd_serve)
+
+    p = commands.add_parser("report", help="write summaries, per-day CSVs and charts for every user")
+    p.add_argument("out", help="output folder (summary.csv, daily/USER_ID.csv, charts/USER_ID.png)")
+    p.add_argument("--workers", type=int, help="worker processes (default: one per CPU)")
+    p.add_argument("--no-charts", action="store_true", help="skip the PNG charts")
+    p.add_argument("--restart", action="store_true", help="report every user again instead of resuming")
+    p.add_argument("--parquet", action="store_true", help="also write summary.parquet (needs pyarrow)")
+    p.add_argument("--user", type=int, action="append", dest="users", metavar="USER_ID",
+                   help="only report this user (can be repeated)")
+    p.set_defaults(func=cmd_report)
+
+    p = commands.add_parser("shards", help="show or rebalance sharded storage (needs --shards)")
+    p.add_argument("action", choices=("status", "rebalance", "move"), help="what to do")
+    p.add_argument("name", nargs="?", help="with move: the user to move")
+    p.add_argument("shard", nargs="?", type=int, help="with move: the shard to move them to")
+    p.add_argument("--count", type=int, help="with rebalance: first add shards until there are this many")
+    p.add_argument("--tolerance", type=float, default=0.1,
+                   help="with rebalance: allowed difference from the average workouts per shard (default: %(default)s)")
+    p.set_defaults(func=cmd_shards)
+
+    p = commands.add_parser("archive", help="move old workouts into columnar archive files (read much faster)")
+    p.add_argument("--before", help="archive workouts dated before this date (DD-MM-YYYY)")
+    p.add_argument("--days", type=int, default=365,
+                   help="without --before: archive workouts older than this many days (default: %(default)s)")
+    p.add_argument("--user", dest="name", help="only archive this user's workouts")
+    p.set_defaults(func=cmd_archive)
+
+    p = commands.add_parser("rebuild-rollups", help="recompute the daily and per-exercise totals tables")
+    p.set_defaults(func=cmd_rebuild_rollups)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.metrics:
+        import metrics
+        metrics.enable(slow_query_ms=args.slow_query_ms, report_at_exit=True)
+    if not args.shards and (args.command == "shards" or (args.db and os.path.isdir(args.db))):
+        args.shards = 1  # A sharded folder; an existing one keeps its own shard count
+    db.init_db(args.db or (db.SHARDS_PATH if args.shards else db.DB_PATH), shards=args.shards)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+import csv
+import itertools
+import json
+import os
+import db, funcs, validation
+
+# Columns every imported row must have, besides one of 'user_id' or 'name' to say whose workout it is
+COLUMNS = ("exercise", "date", "duration", "calories")
+
+
+# Function to stream (line number, record) pairs from a CSV file with a header row
+def read_csv(file):
+    reader = csv.DictReader(file)
+    for record in reader:
+        yield reader.line_num, record
+
+
+# Function to stream (line number, record) pairs from a JSON Lines file (one JSON object per line)
+def read_jsonl(file):
+    for line_num, line in enumerate(file, start=1):
+        if not line.strip():
+            continue  # Skip blank lines
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            record = e  # Reported as a bad row by validate()
+        yield line_num, record
+
+
+# Function to pick the reader for a file based on its extension (or an explicit 'fmt')
+def read_records(file, fmt):
+    if fmt == "csv":
+        return read_csv(file)
+    if fmt == "jsonl":
+        return read_jsonl(file)
+    raise ValueError(f"Unsupported format: {fmt!r} (expected 'csv' or 'jsonl')")
+
+
+# Function to validate one chunk of records a column at a time
+# Returns rows ready for db.log_workouts_bulk and calls on_error(line number, reason) for each bad row
+# User IDs must belong to registered users; names that aren't registered yet are registered by the import
+def validate(chunk, on_error):
+    errors = []  # (line number, reason), reported in file order once the chunk is checked
+    rows = []
+    good = []
+    for line_num, record in chunk:
+        if not isinstance(record, dict):
+            errors.append((line_num, f"not a valid record ({record})"))
+            continue
+        missing = [col for col in COLUMNS if col not in record]
+        if funcs.check_empty(record.get("user_id") or record.get("name")) is None:
+            missing.append("user_id or name")
+        if missing:
+            errors.append((line_num, f"missing {', '.join(missing)}"))
+            continue
+        good.append((line_num, record))
+
+    # Validate each column in one pass; a bad row is reported with the reason from its first bad column
+    exercises = validation.validate_non_empty([record["exercise"] for _, record in good], "exercise name")
+    days = validation.validate_dates([record["date"] for _, record in good])
+    durations = validation.validate_positive_ints([record["duration"] for _, record in good], "duration")
+    calories = validation.validate_positive_ints([record["calories"] for _, record in good], "calories")
+    invalid, reasons = validation.combine(exercises, days, durations, calories)
+
+    checked = []  # (line number, row) of the rows whose user IDs still have to be looked up
+    for (line_num, record), bad, reason, exercise, day, duration, cals in zip(
+            good, invalid, reasons, exercises.values, days.values, durations.values, calories.values):
+        if bad:
+            errors.append((line_num, reason))
+            continue
+        user = record.get("user_id")
+        user = funcs.check_pos_num(user) if user not in (None, "") else str(record["name"]).strip()
+        if user is None:
+            errors.append((line_num, f"invalid user_id {record['user_id']!r}"))
+            continue
+        checked.append((line_num, (user, exercise, day, duration, cals)))
+
+    # Look up every user ID of the chunk at once
+    registered = db.registered_users({row[0] for _, row in checked if not isinstance(row[0], str)})
+    for line_num, row in checked:
+        if isinstance(row[0], str) or row[0] in registered:
+            rows.append(row)
+        else:
+            errors.append((line_num, f"no user with user_id {row[0]}"))
+
+    for line_num, reason in sorted(errors):
+        on_error(line_num, reason)
+    return rows
+
+
+# Function to import a CSV or JSONL workout file; returns (rows imported, rows rejected)
+# The file is read and validated 'batch_size' records at a time, so memory use doesn't grow with file size
+def import_file(path, fmt=None, batch_size=10000, on_error=None):
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+    errors = [0]
+
+    def report(line_num, reason):
+        errors[0] += 1
+        if on_error is not None:
+            on_error(line_num, reason)
+
+    with open(path, newline="", encoding="utf-8") as file:
+        records = read_records(file, fmt)
+        chunks = iter(lambda: list(itertools.islice(records, batch_size)), [])
+        rows = itertools.chain.from_iterable(validate(chunk, report) for chunk in chunks)
+        imported = db.log_workouts_bulk(rows, batch_size=batch_size)
+    return imported, errors[0]
@@ -1,8 +1,20 @@
 import tkinter as tk  # Importing the Tkinter library for creating graphical user interfaces (GUIs)
 from tkinter import messagebox, ttk  # Importing specific modules from Tkinter for message boxes and themed widgets
 import db, funcs, ttkthemes  # Importing custom database functions (db), helper functions (funcs), and the 'ttkthemes' module for theming the GUI
-import matplotlib.pyplot as plt  # Importing the 'matplotlib' library for generating plots and charts
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg  # Allows embedding Matplotlib figures in Tkinter canvas
+import worker  # Runs database work on background threads so the window never freezes
+import metrics, os  # Optional timing of database calls and button handlers (off unless GETFIT_METRICS is set)
+# Matplotlib is slow to import, so it is only loaded when the Graphical Analysis window is first opened
+
+
+# Set up (or upgrade) the database before any window can query it
+db.init_db()
+
+# Set GETFIT_METRICS=1 to time database calls and each button from click to result; a report is printed at exit
+if os.environ.get("GETFIT_METRICS"):
+    metrics.enable(report_at_exit=True)
+
+# Open Graphical Analysis windows by user ID (a user's cached figures can only be shown in one window at a time)
+analysis_windows = {}
 
 
 # Create the main application window with a themed appearance
@@ -39,21 +51,44 @@ def submit_name():
         messagebox.showerror('Error', 'Name cannot be empty!')
         return  # Exit the function early to prevent further processing
 
+    # Look the user up (and register them if needed) on a background thread, then continue in on_done
+    started = metrics.start()
+    done = worker.busy(window, submit_button)
+
+    def on_done(result):
+        done()
+        metrics.finish("submit_name", started)  # Stop before the message box, which waits for the user
+        user_id, registered = result
+        if registered:
+            # Show a success message confirming registration
+            messagebox.showinfo('Registration', f'User {name} registered successfully!')
+        else:
+            # Show a welcome message if the user is already registered
+            messagebox.showinfo('Welcome!', f"Welcome back {name}!")
+
+        # Open the home screen for the user after registration or login
+        open_home(name, user_id)
+
+        # Hide the initial window to transition to the home screen
+        window.withdraw()  # Close the initial window
+
+    worker.run(window, login_or_register, name, on_done=on_done, on_error=lambda e: show_db_error(e, done))
+
+
+def login_or_register(name):
+    # Runs on a worker thread: return the user's ID and whether they had to be registered first
     # Check if the user already exists in the database using a function from the 'db' module
     if db.check_user(name):
-        # Show a welcome message if the user is already registered
-        messagebox.showinfo('Welcome!', f"Welcome back {name}!")
-    else:
-        # Register the new user in the database if they are not already registered
-        db.user_registration(name)
-        # Show a success message confirming registration
-        messagebox.showinfo('Registration', f'User {name} registered successfully!')
+        return db.get_user_id(name), False
+    # Register the new user in the database if they are not already registered
+    return db.user_registration(name), True
 
-    # Open the home screen for the user after registration or login
-    open_home(name)
 
-    # Hide the initial window to transition to the home screen
-    window.withdraw()  # Close the initial window
+def show_db_error(error, done=None):
+    # Report a failed background database job to the user and clear any busy indicator
+    if done is not None:
+        done()
+    messagebox.showerror("Error", f"Database error: {error}")
 
 
 def delete_workout(user_name):
@@ -73,7 +108,7 @@ def delete_workout(user_name):
     date_entry.pack(pady=5, ipadx=10, ipady=5)  # Add padding for aesthetics and make the entry field larger
 
     # Create a button that triggers the delete confirmation process when clicked
-    delete_button = ttk.Button(delete_window, text="Delete", command=lambda: confirm_delete(user_name, date_entry.get(), delete_window))
+    delete_button = ttk.Button(delete_window, text="Delete", command=lambda: confirm_delete(user_name, date_entry.get(), delete_window, delete_button))
     delete_button.pack(pady=10)  # Add padding for aesthetics
 
     # Create a button to cancel the delete operation and close the delete window
@@ -81,30 +116,45 @@ def delete_workout(user_name):
     close_button.pack(pady=5)  # Add padding for aesthetics
 
 
-def confirm_delete(user_name, date, delete_window):
+def confirm_delete(user_name, date, delete_window, delete_button):
     # Check if the date entered is in the correct format
     if funcs.check_date(date) is None:
         messagebox.showerror("Error",
                              "Invalid date format! Please use YYYY-MM-DD.")  # Show error if format is incorrect
         return  # Exit the function if the date format is invalid
 
+    # Delete on a background thread; the rest of the function runs in on_done once it has finished
+    started = metrics.start()
+    done = worker.busy(delete_window, delete_button)
+
+    def on_done(deleted):
+        done()
+        if not deleted:
+            messagebox.showerror("Error", "User not found!")  # Show error if the user ID could not be found
+            return  # Exit the function if the user is not found
+
+        metrics.finish("confirm_delete", started)
+        # Show a success message indicating the workouts have been deleted
+        messagebox.showinfo("Success", f"Workouts on {date} deleted successfully!")
+
+        # Close the delete window after the operation
+        delete_window.destroy()
+
+        # Re-show the home screen window, allowing the user to continue using the app
+        home_screen.deiconify()
+
+    worker.run(delete_window, delete_user_workouts, user_name, date, on_done=on_done, on_error=lambda e: show_db_error(e, done))
+
+
+def delete_user_workouts(user_name, date):
+    # Runs on a worker thread: delete the user's workouts on the given date; False if the user doesn't exist
     # Retrieve the user ID associated with the given username
     user_id = db.get_user_id(user_name)
     if user_id is None:
-        messagebox.showerror("Error", "User not found!")  # Show error if the user ID could not be found
-        return  # Exit the function if the user is not found
-
+        return False
     # Call the database function to delete the workout for the specified user and date
     db.del_workout(user_id, date)
-
-    # Show a success message indicating the workouts have been deleted
-    messagebox.showinfo("Success", f"Workouts on {date} deleted successfully!")
-
-    # Close the delete window after the operation
-    delete_window.destroy()
-
-    # Re-show the home screen window, allowing the user to continue using the app
-    home_screen.deiconify()
+    return True
 
 
 def log_workout(user_id):
@@ -142,7 +192,7 @@ def log_workout(user_id):
     calories_entry.grid(row=3, column=1, padx=20, pady=5, ipadx=10, ipady=5, sticky="ew")  # Position the entry field
 
     # Create a submit button that triggers the confirm_log function when clicked
-    submit_button = ttk.Button(log_window, text="Submit", command=lambda: confirm_log(user_id, exercise_entry.get(), date_entry.get(), duration_entry.get(), calories_entry.get(), log_window))
+    submit_button = ttk.Button(log_window, text="Submit", command=lambda: confirm_log(user_id, exercise_entry.get(), date_entry.get(), duration_entry.get(), calories_entry.get(), log_window, submit_button))
     submit_button.grid(row=4, column=0, padx=20, pady=10, sticky="ew")  # Position the button in the grid
 
     # Create a cancel button that closes the log window when clicked
@@ -150,7 +200,7 @@ def log_workout(user_id):
     cancel_button.grid(row=4, column=1, padx=20, pady=10, sticky="ew")  # Position the button in the grid
 
 
-def confirm_log(user_id, exercise, date, duration, calories, log_window):
+def confirm_log(user_id, exercise, date, duration, calories, log_window, submit_button):
     # Check if the exercise name is empty
     if funcs.check_empty(exercise) is None:
         messagebox.showerror("Error", "Please enter valid details!")  # Show an error message if empty
@@ -170,14 +220,21 @@ def confirm_log(user_id, exercise, date, duration, calories, log_window):
         messagebox.showerror("Error", "Please enter valid numerical values for duration and calories!")  # Show error message
         return  # Exit the function if validation fails
 
-    # Log the workout in the database using the provided details
-    db.log_workout(user_id, exercise, date, duration, calories)
+    # Log the workout in the database using the provided details, on a background thread
+    started = metrics.start()
+    done = worker.busy(log_window, submit_button)
 
-    messagebox.showinfo("Success", "Workout logged successfully!")  # Show success message to the user
-    log_window.destroy()  # Close the log window after logging the workout
+    def on_done(_):
+        done()
+        metrics.finish("confirm_log", started)
+        messagebox.showinfo("Success", "Workout logged successfully!")  # Show success message to the user
+        log_window.destroy()  # Close the log window after logging the workout
 
+    worker.run(log_window, db.log_workout, user_id, exercise, date, duration, calories,
+               on_done=on_done, on_error=lambda e: show_db_error(e, done))
 
-def open_home(name):
+
+def open_home(name, user_id):
     # Create a new window (home screen) for the user after logging in or registering
     global home_screen  # Make home_screen a global variable to access in other functions
     home_screen = tk.Toplevel(window)  # Create a new top-level window (separate from the main one)
@@ -191,9 +248,7 @@ def open_home(name):
     welcome = ttk.Label(home_screen, text=f'Welcome {name}!', font=('Arial', 18), background='#FCEED2', foreground='black')
     welcome.pack(pady=20)  # Position the label with padding for better spacing
 
-    # Get the user's ID from the database, which will be used for various operations
-    user_id = db.get_user_id(name)
-
+    # The user's ID (looked up at login) is used for the various operations below
     # Button to log a new workout, passing the user ID to the log_workout function
     log_button = ttk.Button(home_screen, text='Log Workout', command=lambda: log_workout(user_id))
     log_button.pack(pady=10)  # Add padding around the button for better UI spacing
@@ -207,7 +262,7 @@ def open_home(name):
     view_button.pack(pady=10)  # Add padding around the button for better UI spacing
 
     # Button to view a graphical analysis of workouts, passing the user ID to the view_analysis function
-    analysis_button = ttk.Button(home_screen, text='Graphical Analysis', command=lambda: view_analysis(user_id))
+    analysis_button = ttk.Button(home_screen, text='Graphical Analysis', command=lambda: view_analysis(user_id, analysis_button))
     analysis_button.pack(pady=10)  # Add padding around the button for better UI spacing
 
     # Button to log out of the app, calling the logout function to return to the login screen or close the app
@@ -216,6 +271,9 @@ def open_home(name):
 
 
 def logout():
+    # Make sure every workout logged in this session has been written to the database
+    db.flush_writes()
+
     # Restore the initial login/registration window by showing it again
     window.deiconify()  # Re-display the main window (hidden during user navigation to home)
 
@@ -223,26 +281,54 @@ def logout():
     home_screen.destroy()  # This removes the user's home screen window
 
 
-def view_analysis(user_id):
-    # Retrieve all workout data for the given user
-    workout_data = db.get_workout_data(user_id)
-
-    # Check if workout data is available, show error if none exists
-    if not workout_data:
-        messagebox.showerror("Error", "No workout data found!")
+def view_analysis(user_id, analysis_button):
+    # If the user's graphs are already open, bring that window to the front instead of opening a second one
+    open_window = analysis_windows.get(user_id)
+    if open_window is not None and open_window.winfo_exists():
+        open_window.deiconify()
+        open_window.lift()
         return
 
-    # Process the workout data to calculate total calories burned per day
-    calories_per_day = {}
-    for exercise, date, duration, calories in workout_data:
-        # Accumulate calories for each date, creating a dictionary
-        if date not in calories_per_day:
-            calories_per_day[date] = 0
-        calories_per_day[date] += calories
+    # Load the data on a background thread and draw the graphs once it arrives
+    started = metrics.start()
+    done = worker.busy(home_screen, analysis_button)
+    # Workouts logged or deleted while the data loads are collected here and applied once the window is open
+    early = []
+    db.subscribe(early.append)
+
+    def on_done(result):
+        done()
+        version, data = result
+        # Check if workout data is available, show error if none exists
+        if data is False:
+            db.unsubscribe(early.append)
+            messagebox.showerror("Error", "No workout data found!")
+            return
+        show_analysis(user_id, version, data, early)
+        metrics.finish("view_analysis", started)
+
+    def on_error(error):
+        db.unsubscribe(early.append)
+        show_db_error(error, done)
+
+    # If the home screen is closed first (logout), neither callback runs, so stop collecting changes then too
+    worker.run(home_screen, load_analysis_data, user_id, on_done=on_done, on_error=on_error,
+               on_close=lambda: db.unsubscribe(early.append))
+
+
+def load_analysis_data(user_id):
+    # Runs on a worker thread: fetch and prepare everything the analysis graphs need
+    # (the plotting modules load NumPy and Matplotlib, so they are only imported the first time)
+    import plots
+    return plots.prepare(user_id)
+
 
-    # Sort dates and get total calories burned for each date
-    dates = sorted(calories_per_day.keys())
-    total_calories_per_day = [calories_per_day[date] for date in dates]
+def show_analysis(user_id, version, data, early=None):
+    import plots
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg  # Allows embedding Matplotlib figures in Tkinter canvas
+
+    # Reuse the user's cached figures; they are only redrawn with new data if workouts changed since last time
+    line_fig, bar_fig = plots.figures(user_id, version, data)
 
     # Create a new window for displaying the analysis
     analysis_window = tk.Toplevel(home_screen)
@@ -251,6 +337,7 @@ def view_analysis(user_id):
     analysis_window.resizable(True, True)
     analysis_window.configure(bg='#FCEED2')
     analysis_window.iconbitmap("icon.ico")
+    analysis_windows[user_id] = analysis_window
 
     # Create a scrollable frame to hold the graphs
     scrollable_frame = tk.Frame(analysis_window)
@@ -268,39 +355,13 @@ def view_analysis(user_id):
     canvas.create_window((0, 0), window=graph_frame, anchor='nw')
 
     # First Graph: Line plot for calories burned per day
-    line_canvas = FigureCanvasTkAgg(plt.Figure(), master=graph_frame)
+    line_canvas = FigureCanvasTkAgg(line_fig, master=graph_frame)
     line_canvas.get_tk_widget().pack(pady=5)
 
-    # Plotting the line graph showing calories burned on each date
-    line_ax = line_canvas.figure.add_subplot(211)
-    line_ax.plot(dates, total_calories_per_day, marker='o', color='orange')
-    line_ax.set_title('Calories Burned Per Day')
-    line_ax.set_xlabel('Date')
-    line_ax.set_ylabel('Calories')
-    line_ax.tick_params(axis='x', rotation=25)  # Rotate date labels for clarity
-
     # Second Graph: Bar chart for average calories burned per exercise
-    bar_canvas = FigureCanvasTkAgg(plt.Figure(), master=graph_frame)
+    bar_canvas = FigureCanvasTkAgg(bar_fig, master=graph_frame)
     bar_canvas.get_tk_widget().pack(pady=5)
 
-    # Calculate the average calories burned for each exercise type
-    avg_calories_per_exercise = {}
-    for exercise, _, _, calories in workout_data:
-        if exercise not in avg_calories_per_exercise:
-            avg_calories_per_exercise[exercise] = []
-        avg_calories_per_exercise[exercise].append(calories)
-
-    exercises = list(avg_calories_per_exercise.keys())
-    avg_calories = [sum(calories) / len(calories) for calories in avg_calories_per_exercise.values()]
-
-    # Plotting the bar chart showing average calories burned for each exercise
-    bar_ax = bar_canvas.figure.add_subplot(212)
-    bar_ax.bar(exercises, avg_calories, color='orange')
-    bar_ax.set_title('Average Calories Burned Per Exercise')
-    bar_ax.set_xlabel('Exercise')
-    bar_ax.set_ylabel('Average Calories')
-    bar_ax.tick_params(axis='x', rotation=25)  # Rotate exercise names for clarity
-
     # Render the graphs on the canvas
     line_canvas.draw()
     bar_canvas.draw()
@@ -309,8 +370,50 @@ def view_analysis(user_id):
     graph_frame.update_idletasks()
     canvas.config(scrollregion=canvas.bbox("all"))
 
+    # Keep the graphs current: each logged or deleted workout only changes one day's point and one exercise's bar
+    reloading = []  # Changes that arrive while the data is loaded again, applied once it is back
+
+    def on_change(delta):
+        if delta.user_id != user_id:
+            return
+        if reloading:
+            reloading.append(delta)
+            return
+        changed = plots.apply(delta)
+        if changed is None:
+            # The loaded data may or may not include this change, so load it again
+            reloading.append(delta)
+            worker.run(analysis_window, load_analysis_data, user_id, on_done=on_reloaded, on_error=on_reload_error)
+        elif changed:
+            line_canvas.draw_idle()
+            bar_canvas.draw_idle()
+
+    def on_reloaded(result):
+        version, data = result
+        if data is not False:
+            plots.figures(user_id, version, data)
+            line_canvas.draw_idle()
+            bar_canvas.draw_idle()
+        waiting = reloading[:]
+        reloading.clear()
+        for delta in waiting:
+            on_change(delta)
+
+    def on_reload_error(error):
+        # Stop queueing changes, so the next one tries loading the data again
+        reloading.clear()
+        show_db_error(error)
+
+    changes = worker.forward(analysis_window, on_change, on_close=lambda: db.unsubscribe(changes))
+    db.subscribe(changes)
+    if early is not None:
+        db.unsubscribe(early.append)  # From now on changes arrive through 'changes'
+        for delta in list(early):
+            on_change(delta)  # Changes the loaded data already includes are skipped by plots.apply
+
 
 def view_stats(user_id):
+    started = metrics.start()
     # Create a new window for displaying the workout stats
     stats_window = tk.Toplevel(home_screen)
     stats_window.title("Workout Stats")
@@ -319,25 +422,79 @@ def view_stats(user_id):
     stats_window.configure(bg='#FCEED2')  # Set background color
     stats_window.iconbitmap("icon.ico")  # Set the window icon
 
-    # Retrieve stats from the database (total workouts, average duration, and average calories)
-    total_workouts, avg_duration, avg_calories = db.get_avg_stats(user_id)
-
-    # Display total workouts in a label
-    total_workouts_label = ttk.Label(stats_window, foreground='black', text=f"Total Workouts: {total_workouts}", background='#FCEED2')
+    # Labels start out as a loading message and are filled in once the stats arrive
+    total_workouts_label = ttk.Label(stats_window, foreground='black', text="Loading stats...", background='#FCEED2')
     total_workouts_label.pack(pady=5)
-
-    # Display average workout duration in a label, formatted to two decimal places
-    avg_duration_label = ttk.Label(stats_window, foreground='black', text=f"Average Workout Duration: {avg_duration:.2f} minutes", background='#FCEED2')
+    avg_duration_label = ttk.Label(stats_window, foreground='black', text="", background='#FCEED2')
     avg_duration_label.pack(pady=5)
-
-    # Display average calories burned per workout in a label, formatted to two decimal places
-    avg_calories_label = ttk.Label(stats_window, foreground='black', text=f"Average Calories Burned: {avg_calories:.2f}", background='#FCEED2')
+    avg_calories_label = ttk.Label(stats_window, foreground='black', text="", background='#FCEED2')
     avg_calories_label.pack(pady=5)
 
-    # Button to close the stats window
+    # Button to close the stats window (closing it early also cancels the query)
     close_button = ttk.Button(stats_window, text="Close", command=stats_window.destroy)
     close_button.pack(pady=10)
 
+    # Running totals [workouts, minutes, calories]: the window stays current by adding each logged or deleted
+    # workout to them, instead of reading the stats again
+    totals = []
+    seen = [0, 0]  # db.change_count() before and after the stats were read
+    pending = []  # Changes that arrive while the stats are being read
+
+    def load_stats():
+        # Runs on a worker thread
+        first = db.change_count()
+        stats = db.get_avg_stats(user_id)
+        return first, stats, db.change_count()
+
+    def show():
+        total_workouts, total_duration, total_calories = totals
+        avg_duration = total_duration / total_workouts if total_workouts else 0
+        avg_calories = total_calories / total_workouts if total_workouts else 0
+        # Display total workouts in a label
+        total_workouts_label.configure(text=f"Total Workouts: {total_workouts}")
+        # Display average workout duration in a label, formatted to two decimal places
+        avg_duration_label.configure(text=f"Average Workout Duration: {avg_duration:.2f} minutes")
+        # Display average calories burned per workout in a label, formatted to two decimal places
+        avg_calories_label.configure(text=f"Average Calories Burned: {avg_calories:.2f}")
+
+    def on_done(result):
+        nonlocal started
+        first, (total_workouts, avg_duration, avg_calories), last = result
+        # The sums are whole numbers, so they can be recovered exactly from the averages
+        totals[:] = [total_workouts, round(avg_duration * total_workouts), round(avg_calories * total_workouts)]
+        seen[:] = [first, last]
+        show()
+        if started is not None:
+            metrics.finish("view_stats", started)
+            started = None
+        waiting = pending[:]
+        pending.clear()
+        for delta in waiting:
+            on_change(delta)
+
+    def on_change(delta):
+        if delta.user_id != user_id:
+            return
+        if not totals:
+            pending.append(delta)  # Applied once the stats arrive
+            return
+        if delta.seq <= seen[0]:
+            return  # Already included in the stats that were read
+        if delta.seq <= seen[1]:
+            # Published while the stats were read, so they may or may not include it: read them again
+            totals.clear()
+            worker.run(stats_window, load_stats, on_done=on_done, on_error=show_db_error)
+            return
+        totals[0] += delta.workouts
+        totals[1] += delta.duration
+        totals[2] += delta.calories
+        show()
+
+    changes = worker.forward(stats_window, on_change, on_close=lambda: db.unsubscribe(changes))
+    db.subscribe(changes)
+    # Retrieve stats from the database (total workouts, average duration, and average calories) in the background
+    worker.run(stats_window, load_stats, on_done=on_done, on_error=show_db_error)
+
 
 # Create a 'submit' button widget in the window
 submit_button = ttk.Button(window, text='Submit', command=submit_name)
@@ -346,4 +503,6 @@ submit_button = ttk.Button(window, text='Submit', command=submit_name)
 submit_button.pack(pady=20)
 
 # Starts the main event loop, which keeps the window active and responsive
-window.mainloop()
+# (only when run as a program, so the startup benchmark can import this module and time the first window)
+if __name__ == "__main__":
+    window.mainloop()
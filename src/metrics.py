@@ -0,0 +1,370 @@
+# Opt-in instrumentation for the data layer and the UI: call latency histograms, row counts, connection and
+# transaction counters, and slow SQL statements with their query plans.
+# Nothing is measured until enable() is called; while disabled the db.py functions are the original,
+# unwrapped functions and no SQLite callbacks are installed, so the cost is one 'if' per timed UI handler.
+#   metrics.enable()          # start measuring (wraps the db.py functions listed in DB_FUNCTIONS)
+#   print(metrics.text())     # human-readable snapshot
+#   metrics.prometheus()      # Prometheus text exposition format (served at GET /metrics by 'getfit serve --metrics')
+import atexit
+import bisect
+import collections
+import functools
+import os
+import sys
+import threading
+import time
+import types
+
+# db.py functions that are timed while instrumentation is enabled
+DB_FUNCTIONS = ("check_user", "user_registration", "log_workout", "log_workouts_bulk", "del_workout",
+                "get_user_id", "get_data_version", "get_avg_stats", "get_daily_calories", "get_exercise_avg_calories",
+                "get_workout_data", "get_workout_rows", "iter_workouts", "rebuild_rollups", "flush_writes",
+                "get_plot_totals", "archive_workouts")
+
+# Upper bounds (in seconds) of the latency histogram buckets; anything slower lands in the last, unbounded one
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# How often (in SQLite virtual machine instructions) a running statement checks whether it has become slow
+PROGRESS_STEPS = 10000
+
+# Most recent slow statements kept
+MAX_SLOW_QUERIES = 50
+
+enabled = False
+slow_query_seconds = 0.1  # Statements running at least this long are captured with their query plan
+
+_lock = threading.Lock()
+_histograms = {}  # (kind, name) -> Histogram; kind is 'db' for db.py functions and 'ui' for UI handlers
+_rows = collections.Counter()  # db.py function name -> rows returned
+_counters = collections.Counter()  # 'connections_opened', 'statements', 'commits', 'rollbacks'
+_slow = collections.deque(maxlen=MAX_SLOW_QUERIES)  # SlowQuery records, oldest first
+_originals = {}  # db.py function name -> the unwrapped function, restored by disable()
+# .statement: [sql, start time, SlowQuery or None, database file] of the statement running on this thread
+# .explaining: True while _explain runs its own statements, which aren't traced
+_local = threading.local()
+
+
+# A statement that ran for at least 'slow_query_seconds'. 'seconds' is measured up to the next statement on the
+# same connection or the end of the db.py call that ran it; 'plan' is filled in when the snapshot is taken, on
+# the database the statement ran on ('database', its file; with sharding, the directory or one of the shards)
+class SlowQuery:
+    __slots__ = ("sql", "seconds", "thread", "database", "plan", "finished")
+
+    def __init__(self, sql, seconds, thread, database):
+        self.sql = sql
+        self.seconds = seconds
+        self.thread = thread
+        self.database = database
+        self.plan = None
+        self.finished = False
+
+
+# Latency histogram with the fixed BUCKETS boundaries (cheap to update, and to merge in Prometheus)
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    # Function to estimate a percentile (0-100) as the upper bound of the bucket it falls in
+    def percentile(self, percent):
+        rank = self.count * percent / 100
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+# Function to add one observation to a histogram
+def observe(kind, name, seconds):
+    with _lock:
+        histogram = _histograms.get((kind, name))
+        if histogram is None:
+            histogram = _histograms[(kind, name)] = Histogram()
+        histogram.observe(seconds)
+
+
+# Function to mark the start of a UI handler (button click); returns None while instrumentation is disabled
+def start():
+    return time.perf_counter() if enabled else None
+
+
+# Function to record a UI handler's time from start() until now (call it once the result has been rendered)
+def finish(name, started):
+    if started is not None:
+        observe("ui", name, time.perf_counter() - started)
+
+
+# Function to count the rows in a db.py result (lists of rows and chunks from iter_workouts)
+def _count_rows(result):
+    if type(result) is list:
+        return len(result)
+    days = getattr(result, "days", None)  # A db.WorkoutBatch
+    return len(days) if days is not None else 0
+
+
+# Function to wrap a db.py function so each call is timed and its rows counted
+def _timed(name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException:
+            _end_statement()
+            observe("db", name, time.perf_counter() - started)
+            raise
+        _end_statement()
+        elapsed = time.perf_counter() - started
+        if isinstance(result, types.GeneratorType):
+            return _timed_chunks(name, result, elapsed)
+        observe("db", name, elapsed)
+        if type(result) is list:
+            with _lock:
+                _rows[name] += len(result)
+        return result
+    return wrapper
+
+
+# Function to time a generator (iter_workouts) by the time spent producing its chunks, not the time the caller
+# spends on them; the whole iteration counts as one call
+def _timed_chunks(name, chunks, elapsed):
+    rows = 0
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                _end_statement()
+                elapsed += time.perf_counter() - started
+            rows += _count_rows(chunk)
+            yield chunk
+    finally:
+        chunks.close()
+        observe("db", name, elapsed)
+        with _lock:
+            _rows[name] += rows
+
+
+# SQLite trace callback: called with the text of every statement as it starts (including the BEGIN/COMMIT
+# that sqlite3 issues for transactions) on a connection to 'database'. Also closes the previous statement on this thread
+def _trace(sql, database=None):
+    if sql.startswith("--"):
+        return  # A statement run by a trigger, reported as a comment: part of the statement that fired it
+    if getattr(_local, "explaining", False):
+        return
+    now = time.perf_counter()
+    _end_statement(now)
+    _local.statement = [sql, now, None, database]
+    keyword = sql.split(None, 1)[0].upper() if sql else ""
+    with _lock:
+        _counters["statements"] += 1
+        if keyword == "COMMIT":
+            _counters["commits"] += 1
+        elif keyword == "ROLLBACK":
+            _counters["rollbacks"] += 1
+
+
+# SQLite progress handler: runs every PROGRESS_STEPS instructions of a statement, so a slow statement is
+# captured while it is still running (even one that never finishes). Returning 0 lets it continue
+def _progress():
+    statement = getattr(_local, "statement", None)
+    if statement is not None and statement[2] is None:
+        seconds = time.perf_counter() - statement[1]
+        if seconds >= slow_query_seconds:
+            statement[2] = SlowQuery(statement[0], seconds, threading.current_thread().name, statement[3])
+            with _lock:
+                _slow.append(statement[2])
+    return 0
+
+
+# Function to record the end of the statement running on this thread (if any)
+def _end_statement(now=None):
+    statement = getattr(_local, "statement", None)
+    if statement is None:
+        return
+    _local.statement = None
+    seconds = (now or time.perf_counter()) - statement[1]
+    slow = statement[2]
+    if slow is None and seconds >= slow_query_seconds and not statement[0].startswith("BEGIN"):
+        # Finished between two progress checks (or was waiting for the caller to fetch its rows)
+        slow = SlowQuery(statement[0], seconds, threading.current_thread().name, statement[3])
+        with _lock:
+            _slow.append(slow)
+    if slow is not None:
+        slow.seconds = seconds
+        slow.finished = True
+
+
+# Function to install the callbacks on one connection (called by the pool for every new connection)
+def _watch(con):
+    _install(con)
+    with _lock:
+        _counters["connections_opened"] += 1
+
+
+# Function to install the callbacks on a connection; its statements are traced along with its database file
+def _install(con):
+    database = con.execute("PRAGMA database_list").fetchone()[2]  # The main database's file ('' if in memory)
+    con.set_trace_callback(lambda sql: _trace(sql, database))
+    con.set_progress_handler(_progress, PROGRESS_STEPS)
+
+
+# Function to start collecting metrics; 'slow_query_ms' sets the slow statement threshold
+# 'report_at_exit' prints a text snapshot to standard error when the program exits
+def enable(slow_query_ms=100, report_at_exit=False):
+    global enabled, slow_query_seconds
+    import db, pool
+    slow_query_seconds = slow_query_ms / 1000
+    if not enabled:
+        enabled = True
+        for name in DB_FUNCTIONS:
+            _originals[name] = getattr(db, name)
+            setattr(db, name, _timed(name, _originals[name]))
+        pool.on_open.append(_watch)
+        for opened in pool.registered():  # Every database: the directory and the shards too, if sharded
+            for con in opened.connections():
+                _install(con)
+    if report_at_exit:
+        atexit.register(lambda: print(text(), file=sys.stderr))
+
+
+# Function to stop collecting metrics and put the original db.py functions back (collected data is kept)
+def disable():
+    global enabled
+    import db, pool
+    if not enabled:
+        return
+    enabled = False
+    for name, func in _originals.items():
+        setattr(db, name, func)
+    _originals.clear()
+    if _watch in pool.on_open:
+        pool.on_open.remove(_watch)
+    for opened in pool.registered():
+        for con in opened.connections():
+            con.set_trace_callback(None)
+            con.set_progress_handler(None, 0)
+
+
+# Function to forget everything collected so far
+def reset():
+    with _lock:
+        _histograms.clear()
+        _rows.clear()
+        _counters.clear()
+        _slow.clear()
+
+
+# Function to look up the query plans of slow statements that don't have one yet, each on the database it ran on
+def _explain(queries):
+    statement, _local.statement = getattr(_local, "statement", None), None
+    _local.explaining = True  # Don't trace our own EXPLAINs
+    try:
+        for query in queries:
+            if query.plan is None and query.finished:
+                try:
+                    rows = _connect(query.database).execute("EXPLAIN QUERY PLAN " + query.sql).fetchall()
+                    query.plan = [row[-1] for row in rows]
+                except Exception as e:
+                    query.plan = [f"(no plan: {e})"]
+    finally:
+        _local.explaining = False
+        _local.statement = statement
+
+
+# Function to return this thread's connection to a database file, from the pool that opened it
+# (db.connect_db()'s database if no open pool has that file, e.g. for an in-memory database)
+def _connect(database):
+    import db, pool
+    if database:
+        for opened in pool.registered():
+            if os.path.realpath(opened.path) == os.path.realpath(database):
+                return opened.get()
+    return db.connect_db()
+
+
+# Function to return everything collected so far as plain data
+def snapshot():
+    with _lock:
+        slow = list(_slow)
+    _explain(slow)
+    with _lock:
+        histograms = {
+            f"{kind}.{name}": {"calls": h.count, "rows": _rows.get(name, 0) if kind == "db" else None,
+                               "total_seconds": h.total, "mean_seconds": h.total / h.count,
+                               "p50_seconds": h.percentile(50), "p99_seconds": h.percentile(99),
+                               "max_seconds": h.max}
+            for (kind, name), h in sorted(_histograms.items())
+        }
+        counters = dict(_counters)
+    return {
+        "enabled": enabled,
+        "calls": histograms,
+        "counters": counters,
+        "slow_queries": [{"sql": q.sql, "seconds": q.seconds, "thread": q.thread, "database": q.database,
+                          "finished": q.finished, "plan": q.plan} for q in slow],
+    }
+
+
+# Function to format a snapshot as a text report
+def text():
+    data = snapshot()
+    lines = ["GetFit metrics" + ("" if data["enabled"] else " (disabled)"),
+             f"{'call':40s} {'calls':>8s} {'rows':>9s} {'mean ms':>9s} {'p50 ms':>9s} {'p99 ms':>9s} {'max ms':>9s}"]
+    for name, call in data["calls"].items():
+        rows = "" if call["rows"] is None else call["rows"]
+        lines.append(f"{name:40s} {call['calls']:8d} {rows:>9} {call['mean_seconds'] * 1000:9.2f} "
+                     f"{call['p50_seconds'] * 1000:9.2f} {call['p99_seconds'] * 1000:9.2f} {call['max_seconds'] * 1000:9.2f}")
+    lines.append("counters: " + ", ".join(f"{name}={value}" for name, value in sorted(data["counters"].items())))
+    if data["slow_queries"]:
+        lines.append(f"slow statements (>= {slow_query_seconds * 1000:g} ms):")
+        for query in data["slow_queries"]:
+            state = "" if query["finished"] else " (still running)"
+            lines.append(f"  {query['seconds'] * 1000:.1f} ms{state} [{query['thread']}] {' '.join(query['sql'].split())}")
+            for step in query["plan"] or ():
+                lines.append(f"      {step}")
+    return "\n".join(lines)
+
+
+# Function to format the metrics in the Prometheus text exposition format
+def prometheus():
+    with _lock:
+        histograms = sorted(_histograms.items())
+        rows = dict(_rows)
+        counters = dict(_counters)
+    names = {"db": ("getfit_db_call_seconds", "function", "Latency of db.py calls"),
+             "ui": ("getfit_ui_handler_seconds", "handler", "Time from a UI action to its result being shown")}
+    lines = []
+    for kind, (metric, label, description) in names.items():
+        lines += [f"# HELP {metric} {description}.", f"# TYPE {metric} histogram"]
+        for (k, name), h in histograms:
+            if k != kind:
+                continue
+            seen = 0
+            for bound, count in zip(BUCKETS + (float("inf"),), h.counts):
+                seen += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{metric}_bucket{{{label}="{name}",le="{le}"}} {seen}')
+            lines.append(f'{metric}_sum{{{label}="{name}"}} {h.total}')
+            lines.append(f'{metric}_count{{{label}="{name}"}} {h.count}')
+    lines += ["# HELP getfit_db_rows_total Rows returned by db.py calls.", "# TYPE getfit_db_rows_total counter"]
+    lines += [f'getfit_db_rows_total{{function="{name}"}} {count}' for name, count in sorted(rows.items())]
+    for name in ("connections_opened", "statements", "commits", "rollbacks"):
+        lines += [f"# TYPE getfit_db_{name}_total counter", f"getfit_db_{name}_total {counters.get(name, 0)}"]
+    lines.append("# TYPE getfit_db_slow_statements gauge")
+    lines.append(f"getfit_db_slow_statements {len(_slow)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,215 @@
+import bisect
+import collections
+import threading
+import numpy as np
+import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+import db
+
+# Most points drawn on the calories-per-day line; longer histories are reduced to this many
+MAX_POINTS = 400
+
+# Markers are only drawn while the line has few enough points for them to be readable
+MAX_MARKERS = 60
+
+# Number of users whose figures are kept, least recently used first out
+MAX_CACHED_USERS = 4
+
+# Data for the analysis graphs, prepared on a worker thread and then kept up to date by apply():
+#   days/calories/workouts: calories burned and number of workouts on each day with workouts
+#   exercises/counts/totals: number of workouts and calories burned for each exercise (sorted by name)
+#   seen: (first, last) db.change_count() before and after the workouts were read: changes numbered up to
+#         'first' are included, those after 'last' are not, and those in between may or may not be
+PlotData = collections.namedtuple("PlotData", "days calories workouts exercises counts totals seen")
+
+# Cached figures per user: user_id -> {'version', 'line_fig', 'line', 'bar_fig', 'exercises', 'data', 'seq'}
+# ('seq' is the number of the last change included in 'data')
+_figures = collections.OrderedDict()
+_lock = threading.Lock()  # prepare() runs on worker threads while the Tk thread uses the cache
+
+
+# Function to reduce a series to at most 'max_points' points while keeping its peaks and dips:
+# the points are split into buckets and each bucket keeps its lowest and highest point
+def downsample(x, y, max_points=MAX_POINTS):
+    if len(x) <= max_points:
+        return x, y
+    buckets = max_points // 2
+    edges = np.linspace(0, len(x), buckets + 1).astype(np.int64)[:-1]
+    lows = np.minimum.reduceat(y, edges)
+    highs = np.maximum.reduceat(y, edges)
+    # Position of each bucket's min and max, so the two points are kept in their original order
+    owner = np.repeat(np.arange(buckets), np.diff(np.r_[edges, len(x)]))
+    is_low = y == lows[owner]
+    is_high = y == highs[owner]
+    keep = np.zeros(len(x), dtype=bool)
+    first_low = np.flatnonzero(is_low)[np.unique(owner[is_low], return_index=True)[1]]
+    first_high = np.flatnonzero(is_high)[np.unique(owner[is_high], return_index=True)[1]]
+    keep[first_low] = True
+    keep[first_high] = True
+    return x[keep], y[keep]
+
+
+# Function to get what the analysis graphs need for a user; runs on a worker thread
+# Returns (data version, PlotData), with PlotData None if the cached figures are already up to date,
+# or (data version, False) if the user has no workouts
+def prepare(user_id):
+    first = db.change_count()
+    version = db.get_data_version(user_id)
+    with _lock:
+        cached = _figures.get(user_id)
+        if cached is not None and cached["version"] == version:
+            return version, None
+    daily, exercises = db.get_plot_totals(user_id)  # One row per day and per exercise, not per workout
+    last = db.change_count()
+    if not daily:
+        return version, False
+    days, per_day, calories = (np.array(column, dtype=np.int64) for column in zip(*daily))
+    names, counts, totals = zip(*exercises)
+    counts, totals = np.array(counts, dtype=np.int64), np.array(totals, dtype=np.int64)
+    return version, PlotData(days, calories, per_day, list(names), counts, totals, (first, last))
+
+
+# Function to return the user's (line figure, bar figure), updating the cached ones with 'data' if given
+# Must be called on the Tk thread with the result of prepare()
+def figures(user_id, version, data):
+    if data is None and user_id not in _figures:
+        version, data = prepare(user_id)  # Evicted by other users since prepare() ran; rare, so load here
+    if data is False:
+        data = None  # No workouts any more: the figures stay as they are (empty if new)
+    with _lock:
+        entry = _figures.pop(user_id, None)
+        if entry is None:
+            entry = _new_figures()
+        if data is not None:
+            _update(entry, data)
+            entry["version"] = version
+        _figures[user_id] = entry  # Re-insert as the most recently used
+        while len(_figures) > MAX_CACHED_USERS:
+            _figures.popitem(last=False)  # Drop the least recently used user's figures
+    return entry["line_fig"], entry["bar_fig"]
+
+
+# Function to apply a change to a user's workouts (a db.WorkoutDelta) to their cached figures; call on the Tk thread
+# Only the changed day's point and exercise's bar are updated. Returns True if the figures changed, False if
+# they already include the change (or aren't cached), and None if it can't be told whether the loaded data
+# includes it: then load the data again with prepare() and pass it to figures()
+def apply(delta):
+    with _lock:
+        entry = _figures.get(delta.user_id)
+        if entry is None:
+            return False
+        if entry["data"] is None:
+            return None  # Waiting to be loaded again after an earlier change
+        data = entry["data"]
+        first, last = data.seen
+        if first < delta.seq <= last:
+            entry["data"] = entry["version"] = None
+            return None
+        if delta.seq <= entry["seq"]:
+            return False  # Already applied (each open window passes on every change)
+        entry["seq"] = delta.seq
+
+        # The day's point: update it in place, or add or remove it if the day gains its first or loses its last workout
+        days, calories, workouts = data.days, data.calories, data.workouts
+        index = int(np.searchsorted(days, delta.day))
+        if index < len(days) and days[index] == delta.day:
+            calories[index] += delta.calories
+            workouts[index] += delta.workouts
+            if workouts[index] <= 0:
+                days, calories, workouts = (np.delete(column, index) for column in (days, calories, workouts))
+        elif delta.workouts > 0:
+            days, calories, workouts = (np.insert(column, index, value) for column, value in
+                                        ((days, delta.day), (calories, delta.calories), (workouts, delta.workouts)))
+
+        # The exercise's bar: likewise
+        exercises, counts, totals = data.exercises, data.counts, data.totals
+        position = bisect.bisect_left(exercises, delta.exercise)
+        if position < len(exercises) and exercises[position] == delta.exercise:
+            counts[position] += delta.workouts
+            totals[position] += delta.calories
+            if counts[position] <= 0:
+                exercises = exercises[:position] + exercises[position + 1:]
+                counts, totals = np.delete(counts, position), np.delete(totals, position)
+        elif delta.workouts > 0:
+            exercises = exercises[:position] + [delta.exercise] + exercises[position:]
+            counts, totals = np.insert(counts, position, delta.workouts), np.insert(totals, position, delta.calories)
+
+        moved = days is not data.days  # A point was added or removed
+        data = entry["data"] = data._replace(days=days, calories=calories, workouts=workouts,
+                                             exercises=exercises, counts=counts, totals=totals)
+        if moved or len(days) > MAX_POINTS:
+            _draw_line(entry["line"], data)  # The points (or, for long histories, the downsampled ones) change
+        else:
+            entry["line"].set_ydata(calories)
+            entry["line"].axes.relim()
+            entry["line"].axes.autoscale_view()
+        _draw_bars(entry, data)
+        return True
+
+
+# Function to forget a user's figures (e.g. when they log out)
+def forget(user_id):
+    with _lock:
+        _figures.pop(user_id, None)
+
+
+# Function to create an empty pair of figures with their titles and labels
+def _new_figures():
+    # First Graph: Line plot for calories burned per day
+    line_fig = Figure()
+    line_ax = line_fig.add_subplot(211)
+    line, = line_ax.plot([], [], marker='o', color='orange')
+    line_ax.set_title('Calories Burned Per Day')
+    line_ax.set_xlabel('Date')
+    line_ax.set_ylabel('Calories')
+    # Day numbers count from 01-01-1970, which is also Matplotlib's date epoch
+    line_ax.xaxis.set_major_locator(mdates.AutoDateLocator(maxticks=8))
+    line_ax.xaxis.set_major_formatter(mdates.DateFormatter('%d-%m-%Y'))
+    line_ax.tick_params(axis='x', rotation=25)  # Rotate date labels for clarity
+
+    # Second Graph: Bar chart for average calories burned per exercise
+    bar_fig = Figure()
+    bar_fig.add_subplot(212)
+    return {"version": None, "line_fig": line_fig, "line": line, "bar_fig": bar_fig, "exercises": None,
+            "data": None, "seq": 0}
+
+
+# Function to put new data into existing figures, changing the existing artists where possible
+def _update(entry, data):
+    entry["data"] = data
+    entry["seq"] = data.seen[1]
+    _draw_line(entry["line"], data)
+    _draw_bars(entry, data)
+
+
+# Function to show the calories per day on the line, reduced to at most MAX_POINTS points
+def _draw_line(line, data):
+    days, calories = downsample(data.days, data.calories)
+    line.set_data(days, calories)
+    line.set_marker('o' if len(days) <= MAX_MARKERS else '')
+    line_ax = line.axes
+    line_ax.relim()
+    line_ax.autoscale_view()
+    if len(days) == 1:
+        line_ax.set_xlim(days[0] - 1, days[0] + 1)  # A single day would give an empty date range
+
+
+# Function to show the average calories per workout of each exercise as bars
+def _draw_bars(entry, data):
+    bar_ax = entry["bar_fig"].axes[0]
+    averages = data.totals / np.maximum(data.counts, 1)
+    if entry["exercises"] == data.exercises:
+        # Same exercises as before: only the bar heights change
+        for bar, average in zip(bar_ax.patches, averages):
+            bar.set_height(average)
+        bar_ax.relim()
+        bar_ax.autoscale_view()
+    else:
+        # The set of exercises changed, so the categories on the x axis have to be rebuilt
+        bar_ax.clear()
+        bar_ax.bar(data.exercises, averages, color='orange')
+        bar_ax.set_title('Average Calories Burned Per Exercise')
+        bar_ax.set_xlabel('Exercise')
+        bar_ax.set_ylabel('Average Calories')
+        bar_ax.tick_params(axis='x', rotation=25)  # Rotate exercise names for clarity
+        entry["exercises"] = data.exercises
@@ -0,0 +1,110 @@
+import atexit
+import sqlite3 as sql
+import threading
+import weakref
+
+# Valid values for SQLite's 'synchronous' pragma (how often SQLite fsyncs to disk)
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+
+# Functions called with every new connection any pool opens (used by metrics.py to install its callbacks)
+on_open = []
+
+
+# Holds a thread's connection in the pool's thread-local storage; when the thread ends its storage is freed
+# and the connection is closed with it (see ConnectionPool.get)
+class _Owner:
+    __slots__ = ("con", "__weakref__")
+
+    def __init__(self, con):
+        self.con = con
+
+
+# Long-lived connection manager: every thread gets its own SQLite connection, which is
+# reused for all of that thread's queries until the thread ends or the pool is closed
+class ConnectionPool:
+    def __init__(self, path, synchronous="NORMAL", cached_statements=256, timeout=30.0):
+        if synchronous.upper() not in SYNCHRONOUS_MODES:
+            raise ValueError(f"synchronous must be one of {', '.join(SYNCHRONOUS_MODES)}")
+        self.path = path
+        self.synchronous = synchronous.upper()
+        self.cached_statements = cached_statements  # Size of each connection's prepared-statement cache
+        self.timeout = timeout  # Seconds to wait for another writer to release its lock
+        self._local = threading.local()  # Holds the _Owner of the current thread's connection
+        self._lock = threading.Lock()    # Guards the list of open connections
+        self._connections = []           # Every connection handed out, so close_all() can find them
+        self._closed = False
+
+    # Function to open and configure a brand new connection
+    def _open(self):
+        con = sql.connect(self.path, timeout=self.timeout, cached_statements=self.cached_statements,
+                          check_same_thread=False)
+        # WAL lets readers run while a write is in progress and turns most commits into a
+        # sequential append; in-memory databases don't support it and silently keep 'memory'
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute(f"PRAGMA synchronous={self.synchronous}")
+        for hook in on_open:
+            hook(con)
+        return con
+
+    # Function to return the calling thread's connection, opening it on first use
+    def get(self):
+        owner = getattr(self._local, "owner", None)
+        if owner is None:
+            with self._lock:
+                if self._closed:
+                    raise sql.ProgrammingError("Connection pool has been closed")
+                con = self._open()
+                self._connections.append(con)
+            owner = self._local.owner = _Owner(con)
+            # Short-lived threads (e.g. a benchmark's, or an executor that is shut down) don't keep theirs open
+            weakref.finalize(owner, self._release, con)
+        return owner.con
+
+    # Function to close the connection of a thread that has ended
+    def _release(self, con):
+        with self._lock:
+            if con not in self._connections:
+                return  # Already closed by close_all()
+            self._connections.remove(con)
+        try:
+            con.close()
+        except sql.Error:
+            pass
+
+    # Function to return the connections currently open (one per thread that has used the pool)
+    def connections(self):
+        with self._lock:
+            return list(self._connections)
+
+    # Function to close every connection the pool has opened (safe to call more than once)
+    def close_all(self):
+        with self._lock:
+            self._closed = True
+            connections, self._connections = self._connections, []
+        for con in connections:
+            try:
+                con.close()
+            except sql.ProgrammingError:
+                pass  # Already closed by its owner
+        self._local = threading.local()
+
+
+# Close every pool that is still open when the interpreter exits, so WAL files are checkpointed
+_pools = []
+
+
+def register(pool):
+    _pools.append(pool)
+    return pool
+
+
+# Function to return every registered pool that is still open (e.g. the directory and every shard when sharded)
+def registered():
+    return [pool for pool in _pools if not pool._closed]
+
+
+@atexit.register
+def _close_pools():
+    while _pools:
+        _pools.pop().close_all()
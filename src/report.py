@@ -0,0 +1,198 @@
+# Headless batch report for every user: a summary CSV, a per-day CSV and a PNG chart per user
+# Users are spread over a pool of worker processes (each renders with Matplotlib's Agg backend, no Tk).
+# summary.csv doubles as the checkpoint: a user's row is only written once their files are complete,
+# so an interrupted run continues with the users that have no row yet.
+# Run from the 'src' directory:  python -m getfit report reports/
+import concurrent.futures
+import csv
+import multiprocessing
+import os
+import time
+import db, funcs
+
+SUMMARY_FILE = "summary.csv"
+SUMMARY_COLUMNS = ("user_id", "name", "workouts", "minutes", "calories", "avg_duration", "avg_calories",
+                   "first_workout", "last_workout", "active_days", "longest_streak", "latest_streak", "top_exercise")
+
+# Work is handed out in tasks of several users; each worker should get this many tasks, so one slow task
+# near the end doesn't leave the other workers idle
+TASKS_PER_WORKER = 8
+
+# Figure reused by a worker process for every chart it draws (see _draw)
+_chart = None
+
+
+# Function run once in each worker process: open the same database as the parent
+def _start_worker(path, shards):
+    os.environ["MPLBACKEND"] = "Agg"  # Never try to open a display
+    db.init_db(path, shards=shards)
+
+
+# Function to report on a list of (user ID, name) pairs; runs in a worker process
+# Writes each user's per-day CSV (and chart) and returns their summary rows
+def report_users(users, out_dir, charts=True):
+    import analytics
+    import numpy as np
+    rows = []
+    for user_id, name in users:
+        workouts = analytics.load_workouts(user_id)  # Streamed from the database in array chunks
+        if len(workouts.days) == 0:
+            rows.append((user_id, name, 0, 0, 0, "", "", "", "", 0, 0, 0, ""))
+            continue
+        days, calories = analytics.daily_totals(workouts)
+        _, minutes = analytics.daily_totals(workouts, "durations")
+        counts = np.diff(np.searchsorted(workouts.days, days, side="left"), append=len(workouts.days))
+        with open(os.path.join(out_dir, "daily", f"{user_id}.csv"), "w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(("date", "workouts", "minutes", "calories"))
+            writer.writerows(zip(map(funcs.day_to_date, days.tolist()), counts.tolist(), minutes.tolist(), calories.tolist()))
+
+        exercises, exercise_counts, means, _ = analytics.exercise_stats(workouts)
+        if charts:
+            _draw(name, days, calories, exercises, means, os.path.join(out_dir, "charts", f"{user_id}.png"))
+        longest, latest = analytics.streaks(workouts)
+        total_minutes, total_calories = int(workouts.durations.sum(dtype=np.int64)), int(calories.sum())
+        rows.append((user_id, name, len(workouts.days), total_minutes, total_calories,
+                     round(total_minutes / len(workouts.days), 2), round(total_calories / len(workouts.days), 2),
+                     funcs.day_to_date(int(days[0])), funcs.day_to_date(int(days[-1])), len(days),
+                     longest, latest, exercises[int(exercise_counts.argmax())]))
+    return rows
+
+
+# Function to draw a user's calories per day and average calories per exercise (like the analysis window)
+# into one PNG; the figure is created once per worker process and only its data is replaced for each user
+def _draw(name, days, calories, exercises, averages, path):
+    global _chart
+    import plots
+    if _chart is None:
+        import matplotlib.dates as mdates
+        from matplotlib.figure import Figure
+        figure = Figure(figsize=(8, 8))
+        line_ax, bar_ax = figure.subplots(2, 1)
+        line, = line_ax.plot([], [], color='orange')
+        line_ax.set_title('Calories Burned Per Day')
+        line_ax.set_xlabel('Date')
+        line_ax.set_ylabel('Calories')
+        line_ax.xaxis.set_major_locator(mdates.AutoDateLocator(maxticks=8))
+        line_ax.xaxis.set_major_formatter(mdates.DateFormatter('%d-%m-%Y'))
+        line_ax.tick_params(axis='x', rotation=25)
+        _chart = figure, line, bar_ax
+    figure, line, bar_ax = _chart
+
+    days, calories = plots.downsample(days, calories)
+    line.set_data(days, calories)
+    line.set_marker('o' if len(days) <= plots.MAX_MARKERS else '')
+    line.axes.relim()
+    line.axes.autoscale_view()
+    if len(days) == 1:
+        line.axes.set_xlim(days[0] - 1, days[0] + 1)  # A single day would give an empty date range
+
+    bar_ax.clear()  # Users do different exercises, so the categories are rebuilt every time
+    bar_ax.bar(list(exercises), averages, color='orange')
+    bar_ax.set_title('Average Calories Burned Per Exercise')
+    bar_ax.set_xlabel('Exercise')
+    bar_ax.set_ylabel('Average Calories')
+    bar_ax.tick_params(axis='x', rotation=25)
+
+    figure.suptitle(name)
+    figure.tight_layout()
+    figure.savefig(path, dpi=80)
+
+
+# Function to read the user IDs already in a summary file (the checkpoint of an earlier run)
+# A row cut off by a crash is removed, so that user is simply reported again
+def _finished_users(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path, "rb+") as file:
+        data = file.read()
+        if data and not data.endswith(b"\n"):
+            file.truncate(data.rfind(b"\n") + 1)
+    with open(path, newline="", encoding="utf-8") as file:
+        return {int(row["user_id"]) for row in csv.DictReader(file)}
+
+
+# Function to split users into tasks of roughly equal work (by number of workouts), biggest first, so the
+# heaviest users start early instead of being the last task still running at the end
+def _plan_tasks(users, sizes, count):
+    users = sorted(users, key=lambda user: sizes.get(user[0], 0), reverse=True)
+    target = max(sum(sizes.get(user_id, 0) for user_id, _ in users) / max(count, 1), 1)
+    tasks, task, work = [], [], 0
+    for user in users:
+        task.append(user)
+        work += sizes.get(user[0], 0) + 1
+        if work >= target:
+            tasks.append(task)
+            task, work = [], 0
+    if task:
+        tasks.append(task)
+    return tasks
+
+
+# Function to import the optional 'pyarrow' package, needed to write Parquet
+def _pyarrow():
+    try:
+        import pyarrow.csv
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("writing Parquet needs the 'pyarrow' package (pip install pyarrow)")
+    return pyarrow
+
+
+# Function to write the summary as a Parquet file as well
+def _write_parquet(summary_path):
+    pyarrow = _pyarrow()
+    table = pyarrow.csv.read_csv(summary_path)
+    pyarrow.parquet.write_table(table, os.path.splitext(summary_path)[0] + ".parquet")
+
+
+# Function to report on every user (or only 'user_ids') into 'out_dir', using 'workers' processes
+# (default: one per CPU). Users already in out_dir/summary.csv are skipped unless 'restart' is true.
+# 'progress(done, total, seconds)' is called as tasks finish, 'on_error(users, exception)' for failed tasks.
+# Returns (users reported, users that failed)
+def run(out_dir, workers=None, charts=True, user_ids=None, restart=False, parquet=False, progress=None, on_error=None):
+    if parquet:
+        _pyarrow()  # Fail before the work rather than after it
+    for folder in ("daily", "charts"):
+        os.makedirs(os.path.join(out_dir, folder), exist_ok=True)
+    summary_path = os.path.join(out_dir, SUMMARY_FILE)
+    if restart and os.path.exists(summary_path):
+        os.remove(summary_path)
+    finished = _finished_users(summary_path)
+    wanted = set(user_ids) if user_ids is not None else None
+    users = [user for user in db.list_users()
+             if user[0] not in finished and (wanted is None or user[0] in wanted)]
+    db.flush_writes()  # Workers read the database directly, so queued workouts must be in it
+
+    workers = workers or os.cpu_count() or 1
+    tasks = _plan_tasks(users, {user_id: stats[0] for user_id, stats in db.get_all_stats().items()},
+                        workers * TASKS_PER_WORKER)
+    done = failed = 0
+    start = time.perf_counter()
+    new_file = not os.path.exists(summary_path)
+    with open(summary_path, "a", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        if new_file:
+            writer.writerow(SUMMARY_COLUMNS)
+        # 'spawn' starts clean processes: a forked child would inherit the parent's open SQLite connections
+        context = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context, initializer=_start_worker,
+                                                    initargs=db.location()) as executor:
+            futures = {executor.submit(report_users, task, out_dir, charts): task for task in tasks}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    rows = future.result()
+                except Exception as e:
+                    failed += len(futures[future])
+                    if on_error is not None:
+                        on_error(futures[future], e)
+                    continue
+                writer.writerows(rows)
+                file.flush()
+                os.fsync(file.fileno())  # The checkpoint must be on disk before it counts
+                done += len(rows)
+                if progress is not None:
+                    progress(done, len(users), time.perf_counter() - start)
+    if parquet:
+        _write_parquet(summary_path)
+    return done, failed
@@ -0,0 +1,258 @@
+# Headless HTTP/JSON service over the db.py data layer
+# Start it with:  python -m getfit serve --port 8080
+#
+# Endpoints (request and response bodies are JSON):
+#   POST   /register   {"name"}                                         -> {"user_id"}             (409 if taken)
+#   POST   /login      {"name"}                                         -> {"user_id"}             (404 if unknown)
+#   POST   /workouts   {"user_id", "exercise", "date", "duration", "calories"}
+#                      or {"workouts": [...]} to log many in one transaction -> {"logged"}
+#   DELETE /workouts?user_id=ID&date=DD-MM-YYYY                         -> {"deleted": true}
+#   GET    /stats?user_id=ID                                            -> {"total_workouts", "avg_duration", "avg_calories"}
+#   GET    /analysis?user_id=ID[&by=day|week|month]                     -> {"calories": [[date, total], ...], "exercises": [[name, average], ...]}
+#   GET    /metrics                                                     -> Prometheus text format (404 unless metrics are enabled)
+import asyncio
+import concurrent.futures
+import json
+import urllib.parse
+import db, funcs
+
+# Largest request body accepted, in bytes
+MAX_BODY = 16 * 1024 * 1024
+
+# Reason phrases for the status codes this service sends
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+# Raised by handlers to send an error response
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# Function to check one workout from a request body; returns the row for db.log_workout(s_bulk) or raises HTTPError
+def _workout_row(record):
+    if not isinstance(record, dict):
+        raise HTTPError(400, "each workout must be a JSON object")
+    user_id, duration, calories = funcs.check_pos_nums([record.get("user_id"), record.get("duration"), record.get("calories")])
+    exercise = funcs.check_empty(str(record.get("exercise") or "").strip())
+    date = funcs.check_date(str(record.get("date") or ""))
+    if None in (user_id, exercise, date, duration, calories):
+        raise HTTPError(400, "a workout needs user_id, exercise, date (DD-MM-YYYY) and positive duration and calories")
+    return user_id, exercise, date, duration, calories
+
+
+# Function to check that the workouts' user IDs belong to registered users, so no workout is logged for nobody
+def _check_users(rows):
+    user_ids = {row[0] for row in rows}
+    missing = user_ids - db.registered_users(user_ids)
+    if missing:
+        raise HTTPError(404, f"no user with user_id {min(missing)}")
+
+
+# Function to read a required positive integer query parameter
+def _user_id(query):
+    user_id = funcs.check_pos_num(query.get("user_id", ""))
+    if user_id is None:
+        raise HTTPError(400, "user_id must be a positive integer")
+    return user_id
+
+
+# Functions implementing the endpoints; they run on the executor, so they may block on the database
+
+def register(body, query):
+    name = funcs.check_empty(str(body.get("name") or "").strip())
+    if name is None:
+        raise HTTPError(400, "name cannot be empty")
+    if db.check_user(name):
+        raise HTTPError(409, f"user {name} already exists")
+    return {"user_id": db.user_registration(name)}
+
+
+def login(body, query):
+    user_id = db.get_user_id(str(body.get("name") or "").strip())
+    if user_id is None:
+        raise HTTPError(404, "user not found")
+    return {"user_id": user_id}
+
+
+def log_workouts(body, query):
+    if "workouts" in body:
+        if not isinstance(body["workouts"], list):
+            raise HTTPError(400, "'workouts' must be a list")
+        rows = [_workout_row(record) for record in body["workouts"]]  # Validate everything before writing anything
+        _check_users(rows)
+        return {"logged": db.log_workouts_bulk(rows)}
+    row = _workout_row(body)
+    _check_users([row])
+    db.log_workout(*row)
+    return {"logged": 1}
+
+
+def delete_workouts(body, query):
+    date = funcs.check_date(query.get("date", ""))
+    if date is None:
+        raise HTTPError(400, "date must be in DD-MM-YYYY format")
+    db.del_workout(_user_id(query), date)
+    return {"deleted": True}
+
+
+def stats(body, query):
+    total_workouts, avg_duration, avg_calories = db.get_avg_stats(_user_id(query))
+    return {"total_workouts": total_workouts, "avg_duration": avg_duration, "avg_calories": avg_calories}
+
+
+def analysis(body, query):
+    user_id = _user_id(query)
+    by = query.get("by", "day")
+    if by == "day":
+        calories = db.get_daily_calories(user_id)  # Read straight from the daily totals table
+    elif by in ("week", "month"):
+        import analytics
+        totals = analytics.weekly_totals if by == "week" else analytics.monthly_totals
+        periods, sums = totals(analytics.load_workouts(user_id))
+        calories = [(funcs.day_to_date(int(period)), int(total)) for period, total in zip(periods, sums)]
+    else:
+        raise HTTPError(400, "by must be day, week or month")
+    return {"calories": calories, "exercises": db.get_exercise_avg_calories(user_id)}
+
+
+def metrics_export(body, query):
+    import metrics
+    if not metrics.enabled:
+        raise HTTPError(404, "metrics are disabled (start the service with 'getfit --metrics serve')")
+    return metrics.prometheus()  # Plain text rather than JSON
+
+
+# (method, path) -> handler
+ROUTES = {
+    ("POST", "/register"): register,
+    ("POST", "/login"): login,
+    ("POST", "/workouts"): log_workouts,
+    ("DELETE", "/workouts"): delete_workouts,
+    ("GET", "/stats"): stats,
+    ("GET", "/analysis"): analysis,
+    ("GET", "/metrics"): metrics_export,
+}
+
+
+# The HTTP server: parses requests on the event loop and runs handlers on a bounded thread pool
+class Service:
+    def __init__(self, workers=8, max_pending=256):
+        # One pooled SQLite connection per worker thread; the event loop itself never touches the database
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="getfit-service")
+        # Limits database jobs waiting for a thread; further requests wait here instead of piling up in memory
+        self.pending = asyncio.Semaphore(max_pending)
+        self.server = None
+
+    # Function to start listening; returns the (host, port) actually bound (port 0 picks a free one)
+    async def start(self, host="127.0.0.1", port=8080):
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=True)
+
+    # Function to serve every request on one (keep-alive) connection
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+                method, path, query, headers, body = request
+                status, payload = await self.dispatch(method, path, query, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                self.write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # Client went away
+        except HTTPError as e:
+            self.write_response(writer, e.status, {"error": str(e)}, keep_alive=False)
+        finally:
+            writer.close()
+
+    # Function to read one request; returns (method, path, query dict, headers dict, body bytes) or None at EOF
+    async def read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "malformed request line")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        length = funcs.check_pos_num(headers.get("content-length") or "0") or 0
+        if length > MAX_BODY:
+            raise HTTPError(413, "request body too large")
+        body = await reader.readexactly(length) if length else b""
+        url = urllib.parse.urlsplit(target)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        return method.upper(), url.path, query, headers, body
+
+    # Function to run the handler for a request on the executor; returns (status, JSON-able payload)
+    async def dispatch(self, method, path, query, body):
+        handler = ROUTES.get((method, path))
+        if handler is None:
+            allowed = [m for m, p in ROUTES if p == path]
+            return (405, {"error": f"use {', '.join(allowed)}"}) if allowed else (404, {"error": "no such endpoint"})
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            return 400, {"error": "body is not valid JSON"}
+        if not isinstance(data, dict):
+            return 400, {"error": "body must be a JSON object"}
+        async with self.pending:
+            loop = asyncio.get_running_loop()
+            try:
+                return 200, await loop.run_in_executor(self.executor, handler, data, query)
+            except HTTPError as e:
+                return e.status, {"error": str(e)}
+            except Exception as e:
+                return 500, {"error": f"{type(e).__name__}: {e}"}
+
+    # Function to send a response; 'payload' is sent as JSON, or as plain text if it is a string
+    @staticmethod
+    def write_response(writer, status, payload, keep_alive):
+        if isinstance(payload, str):
+            body, content_type = payload.encode(), "text/plain; version=0.0.4"
+        else:
+            body, content_type = json.dumps(payload).encode(), "application/json"
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+
+
+# Function to run the service until interrupted
+def run(host="127.0.0.1", port=8080, workers=8):
+    async def main():
+        service = Service(workers=workers)
+        bound = await service.start(host, port)
+        print(f"GetFit service listening on http://{bound[0]}:{bound[1]}")
+        try:
+            await service.serve_forever()
+        finally:
+            await service.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
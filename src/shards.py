@@ -0,0 +1,182 @@
+import concurrent.futures
+import os
+import threading
+import zlib
+import pool
+
+# Files in a sharded database folder: a small directory database (users, and which shard holds each one's
+# workouts) and one database per shard with the usual workouts and rollup tables
+DIRECTORY_FILE = "directory.db"
+SHARD_FILE = "shard-{:03d}.db"
+
+
+# Several SQLite files used as one database. Every user's workouts live in exactly one shard, so writers for
+# users on different shards don't wait for each other's lock. The directory is authoritative: once a folder
+# exists, its shard list and user placements are read from it rather than from 'count'
+class ShardSet:
+    def __init__(self, folder, count=4, synchronous="NORMAL", cached_statements=256, setup=None):
+        if count < 1:
+            raise ValueError("a sharded database needs at least one shard")
+        os.makedirs(folder, exist_ok=True)
+        self.path = folder
+        self.synchronous = synchronous
+        self.cached_statements = cached_statements
+        self.setup = setup  # Function called with a connection to create the tables of a new shard
+        self.directory = pool.register(pool.ConnectionPool(os.path.join(folder, DIRECTORY_FILE), synchronous=synchronous,
+                                                           cached_statements=cached_statements))
+        con = self.directory.get()
+        with con:
+            # Same 'users' table as an unsharded database (so user lookups work unchanged), plus each user's shard
+            con.execute("""CREATE TABLE IF NOT EXISTS users(
+                user_id integer PRIMARY KEY AUTOINCREMENT,
+                name text NOT NULL,
+                shard integer NOT NULL)""")
+            con.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_name ON users(name)")
+            con.execute("CREATE TABLE IF NOT EXISTS shards(shard integer PRIMARY KEY, path text NOT NULL)")
+            if con.execute("SELECT COUNT(*) FROM shards").fetchone()[0] == 0:
+                con.executemany("INSERT INTO shards (shard, path) VALUES (?, ?)",
+                                [(shard, SHARD_FILE.format(shard)) for shard in range(count)])
+        self.pools = [self._open(path) for _, path in con.execute("SELECT shard, path FROM shards ORDER BY shard")]
+        self._placement = {}  # user ID -> shard, filled in as users are looked up
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _open(self, path):
+        return pool.register(pool.ConnectionPool(os.path.join(self.path, path), synchronous=self.synchronous,
+                                                 cached_statements=self.cached_statements))
+
+    # Function to pick the shard for a new user: a stable hash of their name, so placement is spread evenly
+    def place(self, name):
+        return zlib.crc32(name.encode("utf-8")) % len(self.pools)
+
+    # Function to return the shard holding a user's workouts
+    # Workouts logged for an ID that was never registered (possible without the directory's help) go to shard 0
+    def shard_of(self, user_id):
+        shard = self._placement.get(user_id)
+        if shard is None:
+            row = self.directory.get().execute("SELECT shard FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            shard = self._placement[user_id] = row[0] if row is not None else 0
+        return shard
+
+    # Function to return the calling thread's connection to the shard holding a user's workouts
+    def get(self, user_id):
+        return self.pools[self.shard_of(user_id)].get()
+
+    # Function to forget cached placements (all, or some users'), e.g. after another process moved users
+    def forget(self, *user_ids):
+        if not user_ids:
+            self._placement.clear()
+        for user_id in user_ids:
+            self._placement.pop(user_id, None)
+
+    # Function to call 'func(connection)' on every shard at once, each on its own thread (SQLite releases the
+    # GIL while a query runs, so the shards are read in parallel); returns the results in shard order
+    def fan_out(self, func):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.pools),
+                                                                       thread_name_prefix="getfit-shard")
+            executor = self._executor
+        futures = [executor.submit(lambda shard=shard: func(shard.get())) for shard in self.pools]
+        return [future.result() for future in futures]
+
+    # Function to add shards until there are 'count' of them (existing users stay where they are; see rebalance)
+    def add_shards(self, count):
+        con = self.directory.get()
+        with con:
+            for shard in range(len(self.pools), count):
+                con.execute("INSERT INTO shards (shard, path) VALUES (?, ?)", (shard, SHARD_FILE.format(shard)))
+        for shard in range(len(self.pools), count):
+            self.pools.append(self._open(SHARD_FILE.format(shard)))
+            if self.setup is not None:
+                self.setup(self.pools[-1].get())
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)  # Recreated with one thread per shard on next use
+                self._executor = None
+
+    # Function to return (users, workouts) for each shard, according to the directory and the rollup tables
+    def loads(self):
+        users = dict(self.directory.get().execute("SELECT shard, COUNT(*) FROM users GROUP BY shard").fetchall())
+        workouts = self.fan_out(lambda con: con.execute("SELECT coalesce(SUM(workouts), 0) FROM exercise_totals").fetchone()[0])
+        return [(users.get(shard, 0), workouts[shard]) for shard in range(len(self.pools))]
+
+    # Function to move one registered user's workouts to another shard; returns the number of workouts moved
+    # Archived workouts stay in the folder's shared archive files; only the record of them moves.
+    # Other writers to the source shard wait while the rows are copied. Safe to repeat after an interruption:
+    # rows left on the target by an unfinished move are cleared first, and the directory only switches to the
+    # target once it holds every row. Other processes keep their cached placement until they call forget()
+    def move_user(self, user_id, target):
+        if not 0 <= target < len(self.pools):
+            raise ValueError(f"no shard {target} (there are {len(self.pools)})")
+        directory = self.directory.get()
+        row = directory.execute("SELECT shard FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"user {user_id} is not registered")
+        source = row[0]
+        if source == target:
+            return 0
+        src, dst = self.pools[source].get(), self.pools[target].get()
+        src.execute("BEGIN IMMEDIATE")
+        try:
+            rows = src.execute("""SELECT user_id, exercise, date, duration, calories FROM workouts
+                                  WHERE user_id = ? ORDER BY workoutId""", (user_id,)).fetchall()
+            archived = src.execute("""SELECT user_id, generation, workouts, duration, calories FROM archives
+                                      WHERE user_id = ?""", (user_id,)).fetchall()
+            with dst:
+                dst.execute("DELETE FROM workouts WHERE user_id = ?", (user_id,))
+                dst.executemany("""INSERT INTO workouts (user_id, exercise, date, duration, calories)
+                                   VALUES (?, ?, ?, ?, ?)""", rows)
+                dst.execute("DELETE FROM archives WHERE user_id = ?", (user_id,))
+                dst.executemany("""INSERT INTO archives (user_id, generation, workouts, duration, calories)
+                                   VALUES (?, ?, ?, ?, ?)""", archived)
+            with directory:
+                directory.execute("UPDATE users SET shard = ? WHERE user_id = ?", (target, user_id))
+            self._placement[user_id] = target
+            src.execute("DELETE FROM workouts WHERE user_id = ?", (user_id,))
+            src.execute("DELETE FROM data_versions WHERE user_id = ?", (user_id,))
+            src.execute("DELETE FROM archives WHERE user_id = ?", (user_id,))
+            src.commit()
+        except BaseException:
+            src.rollback()
+            raise
+        return len(rows)
+
+    # Function to plan moves that bring every shard within 'tolerance' (a fraction) of the average number of
+    # workouts per shard; returns a list of (user ID, from shard, to shard, workouts)
+    def plan_rebalance(self, tolerance=0.1):
+        per_user = self.fan_out(lambda con: con.execute(
+            "SELECT user_id, SUM(workouts) FROM exercise_totals GROUP BY user_id").fetchall())
+        registered = dict(self.directory.get().execute("SELECT user_id, shard FROM users").fetchall())
+        users = [[] for _ in self.pools]  # shard -> [(workouts, user ID)], only registered users can be moved
+        loads = [0] * len(self.pools)
+        for shard, rows in enumerate(per_user):
+            for user_id, workouts in rows:
+                loads[shard] += workouts
+                if registered.get(user_id) == shard:
+                    users[shard].append((workouts, user_id))
+        average = sum(loads) / len(loads)
+        limit = average * (1 + tolerance)
+        moves = []
+        # Move each overloaded shard's biggest users that fit into the currently lightest shard, biggest first
+        for shard in sorted(range(len(loads)), key=loads.__getitem__, reverse=True):
+            for workouts, user_id in sorted(users[shard], reverse=True):
+                if loads[shard] <= limit:
+                    break
+                lightest = min(range(len(loads)), key=loads.__getitem__)
+                # Only move a user if it leaves both shards closer to the average than before
+                if workouts <= loads[shard] - average and loads[lightest] + workouts <= limit:
+                    moves.append((user_id, shard, lightest, workouts))
+                    loads[shard] -= workouts
+                    loads[lightest] += workouts
+        return moves
+
+    # Function to close every shard's connections and the directory's
+    def close_all(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        for shard in self.pools:
+            shard.close_all()
+        self.directory.close_all()
@@ -0,0 +1,37 @@
+# Tests for the column validators; run from the 'src' directory:  python -m unittest discover tests
+import unittest
+import validation
+
+
+class PositiveIntsTest(unittest.TestCase):
+    # Values that are equal as dictionary keys (1, 1.0 and True) must each be checked on their own
+    def test_equal_values_of_different_types(self):
+        self.assertEqual(validation.validate_positive_ints([1, 1, 1, True]).values, [1, 1, 1, None])
+        self.assertEqual(validation.validate_positive_ints([1.0, 1, 1, 1]).values, [None, 1, 1, 1])
+        self.assertEqual(validation.validate_positive_ints(["1", 1, 1, 1.0]).values, [1, 1, 1, None])
+
+    def test_reasons(self):
+        column = validation.validate_positive_ints([1.0, 1, 1, 1], "duration")
+        self.assertEqual(column.invalid, [True, False, False, False])
+        self.assertEqual(column.reasons[0], "duration 1.0 is not a whole number")
+
+    def test_rejected_types(self):
+        values = [1.9, True, [1], {}, None, "", "abc", "0", "-3"]
+        self.assertEqual(validation.validate_positive_ints(values).values, [None] * len(values))
+        self.assertEqual([validation.positive_int(value) for value in values], [None] * len(values))
+
+    def test_accepted(self):
+        values = ["42", " 7 ", "+5", 3, "1_000"]
+        self.assertEqual(validation.validate_positive_ints(values).values, [42, 7, 5, 3, 1000])
+        self.assertEqual([validation.positive_int(value) for value in values], [42, 7, 5, 3, 1000])
+
+
+class DatesTest(unittest.TestCase):
+    def test_repeated_dates(self):
+        values = ["01-02-2024", "2024-02-01", "31-02-2024", 19754] * 3
+        days = validation.validate_dates(values).values
+        self.assertEqual(days, [19754, 19754, None, None] * 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+# Fast validation of user input and imported columns, without datetime/strptime or exceptions on the common path
+# The single-value checks in funcs.py are built on this module, so the GUI keeps the same behaviour
+import collections
+import functools
+import re
+
+# Distinct date strings remembered by parse_day (imports repeat the same few thousand dates over and over)
+DATE_CACHE_SIZE = 65536
+
+# Same fields strptime accepts for '%d-%m-%Y' and '%Y-%m-%d': 1 or 2 digit days and months, 4 digit years
+_DAY = r"(3[01]|[12]\d|0[1-9]|[1-9]| [1-9])"
+_MONTH = r"(1[0-2]|0[1-9]|[1-9])"
+_DMY = re.compile(rf"{_DAY}-{_MONTH}-(\d\d\d\d)")
+_ISO = re.compile(rf"(\d\d\d\d)-{_MONTH}-{_DAY}")
+
+# Days in each month of a non-leap year (index 0 unused)
+_MONTH_DAYS = (0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+# Result of validating a whole column:
+#   values   the converted value of each row, or None if it is invalid
+#   invalid  a mask: True for each invalid row
+#   reasons  why each row is invalid, or None for valid rows
+Column = collections.namedtuple("Column", "values invalid reasons")
+
+
+# Function to count the days from 01-01-1970 to a (year, month, day) date, using integer arithmetic only
+# (the proleptic Gregorian calendar, as used by datetime)
+def days_from_civil(year, month, day):
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+
+# Function to check that a (year, month, day) date exists: day 31 of a 30 day month or 29-02 of a non-leap year don't
+def _is_real(year, month, day):
+    if year < 1:
+        return False
+    if day <= _MONTH_DAYS[month]:
+        return True
+    return month == 2 and day == 29 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+
+# Function to parse a DD-MM-YYYY date (or, if 'iso' is true, also a YYYY-MM-DD one) into days since 01-01-1970
+# Returns None if it isn't a valid date. Results are memoized, so repeated strings cost one dictionary lookup
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_day(text, iso=True):
+    match = _DMY.fullmatch(text)
+    if match is not None:
+        day, month, year = match.groups()
+    elif iso and (match := _ISO.fullmatch(text)) is not None:
+        year, month, day = match.groups()
+    else:
+        return None
+    year, month, day = int(year), int(month), int(day)
+    if not _is_real(year, month, day):
+        return None
+    return days_from_civil(year, month, day)
+
+
+# Function to explain why parse_day rejected a value
+def date_error(value, iso=True):
+    expected = "DD-MM-YYYY or YYYY-MM-DD" if iso else "DD-MM-YYYY"
+    if not isinstance(value, str) or not value:
+        return f"missing date (expected {expected})"
+    if _DMY.fullmatch(value) or (iso and _ISO.fullmatch(value)):
+        return f"{value!r} is not a real date"
+    return f"invalid date {value!r} (expected {expected})"
+
+
+# Function to return a value as a positive integer, or None; strings follow the rules of int(), but digit strings
+# (nearly every input) are converted without raising and catching an exception when they are invalid.
+# Only ints and strings are accepted: int() would truncate 1.9 to 1 and read True as 1, and fail on lists
+def positive_int(value):
+    if type(value) is str and value.isascii():
+        if value.isdigit():
+            value = int(value)
+            return value if value > 0 else None
+        stripped = value.strip()
+        if not stripped or not stripped.lstrip("+-").replace("_", "").isdigit():
+            return None  # Can't be an integer: skip the exception int() would raise
+    elif type(value) is not int and type(value) is not str:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        return None
+    return value if value > 0 else None
+
+
+# Function to validate a column of dates; values are day numbers (see parse_day)
+def validate_dates(values, iso=True):
+    return _column(values, lambda dates: [parse_day(date, iso) if type(date) is str else None for date in dates],
+                   lambda value: date_error(value, iso))
+
+
+# Function to validate a column of positive whole numbers; 'name' is used in the reasons
+def validate_positive_ints(values, name="value"):
+    return _column(values, _positive_ints, lambda value: _number_error(value, name))
+
+
+# Function to validate a column of text that mustn't be empty (surrounding whitespace is ignored);
+# values are the stripped strings
+def validate_non_empty(values, name="value"):
+    return _column(values, lambda texts: [(str(text).strip() or None) if text is not None else None for text in texts],
+                   lambda value: f"{name} is empty")
+
+
+# Function to convert a list of values like positive_int
+# In a column nearly every value is valid, so one loop with a try block (free unless something fails)
+# beats a function call per value
+def _positive_ints(values):
+    result = []
+    append = result.append
+    for value in values:
+        kind = type(value)
+        if kind is not int and kind is not str:
+            append(None)  # Not truncated or converted like int() would (e.g. 1.9 or True)
+            continue
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            append(None)
+            continue
+        append(value if value > 0 else None)
+    return result
+
+
+def _number_error(value, name):
+    if value is None or value == "":
+        return f"missing {name}"
+    if type(value) is not int and type(value) is not str:
+        return f"{name} {value!r} is not a whole number"
+    try:
+        int(value)
+    except (TypeError, ValueError):
+        return f"{name} {value!r} is not a whole number"
+    return f"{name} {value!r} is not positive"
+
+
+# Function to build a Column; 'convert' turns a list of values into a list of converted values (None if invalid)
+# Columns of dates, durations and calories usually repeat the same values many times, so then each distinct
+# value is only converted once. The reasons are only worked out for the invalid rows
+def _column(values, convert, reason):
+    values = values if type(values) is list else list(values)
+    # Values of different types are told apart: 1, 1.0 and True are equal dictionary keys, but only 1 is valid
+    keys = values if len(set(map(type, values))) <= 1 else list(zip(map(type, values), values))
+    try:
+        distinct = list(dict.fromkeys(keys))
+    except TypeError:
+        distinct = None  # Unhashable values, e.g. a list in a JSON file
+    if distinct is None or len(distinct) * 2 > len(values):
+        parsed = convert(values)  # Mostly distinct values: converting them all is cheaper than looking them up
+        any_invalid = None in parsed
+    else:
+        converted = convert(distinct if keys is values else [value for _, value in distinct])
+        any_invalid = None in converted
+        parsed = list(map(dict(zip(distinct, converted)).__getitem__, keys))
+    reasons = [None] * len(parsed)
+    if not any_invalid:
+        return Column(parsed, [False] * len(parsed), reasons)
+    invalid = [value is None for value in parsed]
+    for index, value in enumerate(values):
+        if invalid[index]:
+            reasons[index] = reason(value)
+    return Column(parsed, invalid, reasons)
+
+
+# Function to merge the results of several columns of the same rows
+# Returns (invalid mask, reasons): a row is invalid if any column is, with the first column's reason
+def combine(*columns):
+    invalid = [any(flags) for flags in zip(*(column.invalid for column in columns))]
+    reasons = [None] * len(invalid)
+    for index, bad in enumerate(invalid):
+        if bad:
+            reasons[index] = next(column.reasons[index] for column in columns if column.invalid[index])
+    return invalid, reasons
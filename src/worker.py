@@ -0,0 +1,84 @@
+import concurrent.futures
+import queue
+import tkinter as tk
+
+# Threads that run database queries and data preparation so the Tk main loop never waits on them
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="getfit-worker")
+
+# How often (in milliseconds) the Tk thread checks whether a background job has finished
+POLL_MS = 15
+
+# How often (in milliseconds) the Tk thread passes on calls queued by forward()
+FORWARD_MS = 100
+
+
+# Function to run func(*args) on a worker thread and pass its result to on_done(result) on the Tk thread
+# 'owner' is the window the result is for: if it is closed first, the job is cancelled (or, if it already
+# started, its result is dropped) and on_close() is called instead (e.g. to unsubscribe). on_error(exception) is
+# called instead of on_done if func raises
+def run(owner, func, *args, on_done=None, on_error=None, on_close=None):
+    future = _executor.submit(func, *args)
+
+    def poll():
+        try:
+            alive = owner.winfo_exists()
+        except tk.TclError:
+            alive = False  # The whole application has been closed
+        if not alive:
+            future.cancel()
+            if on_close is not None:
+                on_close()
+            return
+        if not future.done():
+            owner.after(POLL_MS, poll)  # Check again shortly, leaving the main loop free in between
+            return
+        error = future.exception()
+        if error is not None:
+            if on_error is not None:
+                on_error(error)
+            else:
+                raise error  # Reported by Tk's callback error handler
+        elif on_done is not None:
+            on_done(future.result())
+
+    owner.after(POLL_MS, poll)
+    return future
+
+
+# Function to return a function that can be called from any thread (e.g. a db.subscribe callback): each call
+# is queued, and func is called with the same arguments on the Tk thread. Once 'owner' is closed, queued calls
+# are dropped and on_close() is called (e.g. to unsubscribe)
+def forward(owner, func, on_close=None):
+    calls = queue.SimpleQueue()
+
+    def drain():
+        try:
+            alive = owner.winfo_exists()
+        except tk.TclError:
+            alive = False  # The whole application has been closed
+        if not alive:
+            if on_close is not None:
+                on_close()
+            return
+        while not calls.empty():
+            func(*calls.get())
+        owner.after(FORWARD_MS, drain)
+
+    owner.after(FORWARD_MS, drain)
+    return lambda *args: calls.put(args)
+
+
+# Function to show that 'widget' is busy: a watch cursor, and the given buttons disabled until done() is called
+def busy(widget, *buttons):
+    widget.configure(cursor="watch")
+    for button in buttons:
+        button.state(["disabled"])
+
+    def done():
+        try:
+            widget.configure(cursor="")
+            for button in buttons:
+                button.state(["!disabled"])
+        except tk.TclError:
+            pass  # The window was closed while the job ran
+    return done
@@ -0,0 +1,149 @@
+import queue
+import threading
+import time
+
+# Durability modes for WriteBehind:
+#   'ack'   - submit() returns once the row is committed (group commit: concurrent callers share one commit)
+#   'delay' - submit() returns as soon as the row is queued; it is committed within 'max_delay' seconds
+DURABILITY_MODES = ("ack", "delay")
+
+# Marker put on the queue to make the writer thread commit what it has and report back
+_FLUSH = object()
+
+
+# Raised by WriteBehind methods when a background commit failed
+class WriteBehindError(Exception):
+    pass
+
+
+# Queue of rows drained by a single writer thread, which commits them in groups of up to 'max_batch' rows.
+# In 'ack' mode a group is whatever queued up while the previous commit ran (callers are waiting, so it never
+# waits for more); in 'delay' mode it also waits up to 'max_delay' seconds after its first row for more rows.
+# 'commit(rows)' does the actual write and is only ever called from the writer thread, so SQLite sees one writer;
+# it must write all the rows or none of them (e.g. in one transaction), since a failed group is retried row by row
+class WriteBehind:
+    def __init__(self, commit, durability="ack", max_batch=1000, max_delay=0.01, max_queue=100000):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"durability must be one of {', '.join(DURABILITY_MODES)}")
+        self.durability = durability
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._commit = commit
+        # Bounded: when the writer falls behind, submit() blocks (backpressure) instead of using unbounded memory
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._error = None  # First failure of a 'delay' mode commit, raised by the next flush()/close()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="getfit-writer", daemon=True)
+        self._thread.start()
+
+    # Function to queue one row; in 'ack' mode, waits until it has been committed
+    # 'timeout' limits how long to wait for room in a full queue (None waits for as long as it takes)
+    def submit(self, row, timeout=None):
+        if self._closed:
+            raise WriteBehindError("write-behind queue is closed")
+        if self.durability == "delay":
+            self._raise_error()
+            self._queue.put((row, None), timeout=timeout)
+            return
+        waiter = [threading.Event(), None]  # [committed, exception]
+        self._queue.put((row, waiter), timeout=timeout)
+        waiter[0].wait()
+        if waiter[1] is not None:
+            raise WriteBehindError(f"write failed: {waiter[1]}") from waiter[1]
+
+    # Function to wait until every row queued so far has been committed
+    def flush(self):
+        if self._thread.is_alive():
+            done = threading.Event()
+            self._queue.put((_FLUSH, done))
+            done.wait()
+        self._raise_error()
+
+    # Function to commit everything still queued and stop the writer thread
+    def close(self):
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put((None, None))  # Tells the writer thread to exit
+        self._thread.join()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise WriteBehindError(f"a queued write failed: {error}") from error
+
+    # The writer thread: collect a group of rows, commit them together, tell their submitters
+    def _run(self):
+        stopping = False
+        while not stopping:
+            row, waiter = self._queue.get()
+            if row is None:
+                return
+            rows, waiters, flushes = [], [], []
+            deadline = time.monotonic() + self.max_delay
+            while True:
+                if row is _FLUSH:
+                    flushes.append(waiter)
+                    break  # Commit now rather than waiting for the group to fill up
+                rows.append(row)
+                waiters.append(waiter)  # None for rows nobody waits for ('delay' mode)
+                if len(rows) >= self.max_batch:
+                    break
+                try:
+                    if self.durability == "ack":
+                        row, waiter = self._queue.get_nowait()
+                    else:
+                        row, waiter = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if row is None:
+                    stopping = True  # Exit after committing this group
+                    break
+            self._write(rows, waiters)
+            for done in flushes:
+                done.set()
+
+    # Function to commit a group of rows and tell their submitters. If the group fails, its rows are committed
+    # one at a time, so one bad row doesn't fail the other rows that happened to share its commit
+    def _write(self, rows, waiters):
+        if not rows:
+            return
+        try:
+            self._commit(rows)
+            errors = [None] * len(rows)
+        except Exception as e:
+            errors = [e] if len(rows) == 1 else [self._try_commit(row) for row in rows]
+        for waiter, error in zip(waiters, errors):
+            if waiter is not None:
+                waiter[1] = error
+                waiter[0].set()
+            elif error is not None and self._error is None:
+                self._error = error  # Nobody is waiting for this row; report it at the next flush
+
+    # Function to commit a single row; returns the exception if it fails, else None
+    def _try_commit(self, row):
+        try:
+            self._commit([row])
+        except Exception as e:
+            return e
+        return None
+
+
+# Several WriteBehind queues behind one submit(): 'route(row)' picks the queue for each row (e.g. one per
+# database shard), so rows for different queues are committed in parallel by their own writer threads
+class Partitioned:
+    def __init__(self, queues, route):
+        self.queues = queues
+        self.route = route
+
+    def submit(self, row, timeout=None):
+        self.queues[self.route(row)].submit(row, timeout)
+
+    def flush(self):
+        for part in self.queues:
+            part.flush()
+
+    def close(self):
+        for part in self.queues:
+            part.close()